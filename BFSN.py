@@ -1,41 +1,53 @@
-from collections import defaultdict
-import pandas as pd
-def BFS4(cur_number, queue,df,visited,graph):
-    queue.append(cur_number)
-    visited[cur_number] = 0
+import numpy as np
+from scipy.sparse.csgraph import connected_components
+from callgraph import CallGraph
 
-    # Initialize the list of tuples(component reachable from this number)
-    this_comp = set()
-    while queue:
-        cur_vertex = queue.pop(0)
-        cur_distance = visited[cur_vertex]
+## Weakly connected components of a CallGraph, labelled once for the whole graph.
+## Members of each component are kept grouped (members[start[c]:start[c+1]])
+## so the numbers of a component are a slice instead of a traversal.
+class Components:
+    def __init__(self, graph):
+        self.graph = graph
+        self.count, self.labels = connected_components(graph.counts, directed=True, connection='weak')
+        nodes = graph.nodes()
+        order = np.argsort(self.labels[nodes], kind='mergesort')
+        self.members = nodes[order]
+        self.start = np.searchsorted(self.labels[self.members], np.arange(self.count + 1))
 
-        for node in graph[cur_vertex]:
-            if node not in visited:
-                queue.append(node)
-                # Add to a this component
-              #  tup = (cur_vertex, node) # what is tup doing?
-                this_comp.add(node)
-                this_comp.add(cur_vertex)
-                visited[node] = cur_distance + 1
-    return this_comp,visited
+    def numbers_of(self, label):
+        return self.graph.numbers[self.members[self.start[label]:self.start[label+1]]]
 
 
-## Using the BFS4 function and finding all components
-def bfs(numbers,df):
-    queue = []
-    visited = {}
-    graph = defaultdict(list)
-    #if df.at[i,'DateTime'] >= start_interval and df.at[i,'DateTime'] <= end_interval:
-    df.apply(lambda x:graph[x['Caller']].append(x['Receiver']),axis=1)
-    df.apply(lambda x:graph[x['Receiver']].append(x['Caller']),axis=1)
-    unique_callers = df["Caller"].unique()
-    unique_receivers = df["Receiver"].unique()
-    numbers_status = {numbers[i]: False for i in range(len(numbers))}
+## Nodes within hops calls of the seed nodes (in either direction).
+## Returns an array with the no. of hops of every node from the nearest seed, -1 for nodes further away.
+def ego_network(graph, seeds, hops):
+    distance = np.full(len(graph), -1)
+    frontier = np.zeros(len(graph))
+    seeds = np.asarray(seeds)
+    seeds = seeds[seeds >= 0]
+    distance[seeds] = 0
+    frontier[seeds] = 1
+    for hop in range(1, hops + 1):
+        reached = (graph.undirected.dot(frontier) > 0) & (distance == -1)
+        if not reached.any():
+            break
+        distance[reached] = hop
+        frontier = reached.astype(float)
+    return distance
+
+
+## Finding the components that contain the numbers
+## graph is the CallGraph of df and components its Components, built here if not given
+def bfs(numbers,df,graph=None,components=None):
+    if graph is None:
+        graph = CallGraph(df)
+    if components is None:
+        components = Components(graph)
     list_of_components = []
-    for it in range(len(numbers_status)):
-        if numbers_status[numbers[it]] == False:
-            numbers_status[numbers[it]] = True
-            cur_component,visited = BFS4( numbers[it], queue,df,visited,graph)
-            list_of_components.append(cur_component)
+    seen = set()
+    for node in graph.node_of(numbers):
+        if node == -1 or components.labels[node] in seen:
+            continue
+        seen.add(components.labels[node])
+        list_of_components.append(set(components.numbers_of(components.labels[node]).tolist()))
     return list_of_components
@@ -15,6 +15,26 @@ StatAnom_layout=html.Div([
                         options=[{'label': 'None', 'value': 0}]+[{'label': 'Duration - CDR', 'value': 1}] + [{'label': 'Duration - IPDR', 'value': 2}]+[{'label': 'Uplink Volume', 'value': 3}]+[
                             {'label': 'Downlink Volume', 'value': 4}] + [{'label': 'Total Volume', 'value': 5}],
                         value=0,
-                )
+                ),
+
+                html.H3(''),
+
+                dcc.Dropdown(
+                        id='estimator-dropdown',
+                        options=[{'label': 'Mean + alpha * SD', 'value': 'sd'}] + [{'label': 'Median + alpha * MAD', 'value': 'mad'}] + [
+                            {'label': 'Quantile of alpha', 'value': 'quantile'}],
+                        value='sd',
+                ),
+
+                dcc.Slider(
+                        id='alpha-slider',
+                        min=0,
+                        max=5,
+                        step=0.25,
+                        marks={i: str(i) for i in range(6)},
+                        value=2,
+                ),
+
+                html.Pre(id='stat-anom-flagged'),
             ])
     ],id='stat-anom')  
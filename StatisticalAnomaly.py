@@ -1,6 +1,6 @@
-import pandas as pd
 import numpy as np 
 from functools import reduce
+from scipy import stats
 
 
 
@@ -10,21 +10,15 @@ def SumFeatures(df, pivot_identifier, SD_dict):
 			  The index of the dataframe are the uniqe numbers present in the whole dataframe.
 	"""
 
+	features = list(SD_dict.keys())
 
-	def UpdateFunc(row_df):
+	unique_instances = reduce(np.union1d, [df[pivot].unique() for pivot in pivot_identifier])
 
-		for pivot in (pivot_identifier):
-			for feature in SD_dict.keys():
-				new_df.loc[row_df[pivot]][feature] += row_df[feature]
+	# One row per (identifier, record), then a single grouped sum over all the features.
+	stacked = df[pivot_identifier + features].melt(id_vars=features, value_vars=pivot_identifier, value_name='identifier')
 
-
-	copy_df = df.drop([df.columns[i] for i in range(len(df.columns)) if df.columns[i] not in pivot_identifier + list(SD_dict.keys())], axis = 1).copy(deep=True)
-
-	unique_instances = reduce(np.union1d, (*[copy_df[pivot_identifier[i]].unique() for i in range(len(pivot_identifier))]))
-
-	new_df = pd.DataFrame(index =unique_instances, columns = list(SD_dict.keys()), data=0.0)
-
-	copy_df.apply(UpdateFunc, axis=1)
+	new_df = stacked.groupby('identifier')[features].sum().reindex(unique_instances, fill_value=0).astype(float)
+	new_df.index.name = None
 
 	return new_df
 
@@ -67,3 +61,60 @@ def StatisticalAnomalyFinder(df, pivot_identifier, SD_dict):
 		Results_dict[feature] = new_df.loc[new_df[feature] > p_values[feature]][feature].copy()
 
 	return Results_dict, p_values
+
+
+
+class AnomalyEngine:
+	"""
+	Statistical anomalies for several features and thresholds, with the per entity sums computed only once.
+
+	tables : A dict of name -> (df, pivot_identifier, features), the sums of the features along the pivot
+			 identifiers are computed for each (see SumFeatures). Example, 'cdr' -> (cdr_df, ['Caller', 'Receiver'], ['Duration']).
+
+	Each (name, feature) keeps its sums sorted, so any threshold is answered with a binary search.
+	Thresholds are computed with one of the estimators:
+			'sd' : mean + alpha * standard deviation
+			'mad' : median + alpha * MAD (scaled by 1.4826 to match the standard deviation for normal data), robust to the outliers themselves.
+			'quantile' : the empirical quantile of the sums that a normal distribution has at mean + alpha * standard deviation.
+	"""
+
+	def __init__(self, tables):
+		self.sums = {}
+		self.order = {}
+		self.sorted = {}
+		self.estimates = {}
+		for name, (df, pivot_identifier, features) in tables.items():
+			new_df = SumFeatures(df, pivot_identifier, dict.fromkeys(features))
+			for feature in features:
+				key = (name, feature)
+				values = new_df[feature]
+				self.sums[key] = values
+				self.order[key] = np.argsort(values.values, kind='mergesort')
+				self.sorted[key] = values.values[self.order[key]]
+				median = np.median(values.values) if len(values) else np.nan
+				self.estimates[key] = {
+					'mean': values.mean(),
+					'std': values.std(),
+					'median': median,
+					'mad': 1.4826 * np.median(np.abs(values.values - median)) if len(values) else np.nan,
+				}
+
+	def threshold(self, name, feature, alpha, method='sd'):
+		key = (name, feature)
+		estimates = self.estimates[key]
+		if method == 'mad':
+			return estimates['median'] + alpha * estimates['mad']
+		if method == 'quantile':
+			if len(self.sorted[key]) == 0:
+				return np.nan
+			return np.quantile(self.sorted[key], stats.norm.cdf(alpha))
+		return estimates['mean'] + alpha * estimates['std']
+
+	def anomalies(self, name, feature, alpha, method='sd'):
+		"""
+		Returns : A Series of the sums above the threshold, largest first, and the threshold.
+		"""
+		key = (name, feature)
+		threshold = self.threshold(name, feature, alpha, method)
+		first = np.searchsorted(self.sorted[key], threshold, side='right')
+		return self.sums[key].iloc[self.order[key][first:][::-1]], threshold
@@ -5,7 +5,7 @@ Created on Fri May 15 11:45:07 2020
 @author: aransil
 """
 
-import math
+import numpy as np
 
 # Start and end are lists defining start and end points
 # Edge x and y are lists used to construct the graph
@@ -14,143 +14,113 @@ import math
 # arrowLength is the length of the arrowhead
 # arrowAngle is the angle in degrees that the arrowhead makes with the edge
 # dotSize is the plotly scatter dot size you are using (used to even out line spacing when you have a mix of edge lengths)
+# Single edge form of addEdges, appends None separated points to the lists.
 def addEdge(start, end, edge_x, edge_y, lengthFrac=1, arrowPos = None, arrowLength=0.025, arrowAngle = 30, dotSize=20):
-    
-    # Get start and end cartesian coordinates
-    x0, y0 = start
-    x1, y1 = end
-    
+
+    xs, ys = addEdges([start], [end], lengthFrac, arrowPos, arrowLength, arrowAngle, dotSize)
+    points = edgeStride - 1 if not np.isnan(xs[3]) else 3   # The separator closing the edge is left out
+    edge_x.extend(_with_none(xs[:points]))
+    edge_y.extend(_with_none(ys[:points]))
+    return edge_x, edge_y
+
+# Single edge form of addEdgesmap, appends None separated points to the lists and dura_input once per point to duration_output.
+# lengthFrac and dotSize are not used on the map.
+def addEdgemap(start, end, dura_input, edge_x, edge_y,duration_output, lengthFrac=1, arrowPos = None, arrowLength=0.025, arrowAngle = 30, dotSize=20):
+
+    xs, ys = addEdgesmap([start], [end], arrowPos, arrowLength, arrowAngle)
+    points = mapEdgeStride if not np.isnan(xs[3]) else 3
+    edge_x.extend(_with_none(xs[:points]))
+    edge_y.extend(_with_none(ys[:points]))
+    duration_output.extend([dura_input] * points)
+    return edge_x, edge_y, duration_output
+
+def _with_none(values):
+    return [None if np.isnan(v) else v for v in values.tolist()]
+
+# Tip and the two wings of the arrowheads of the edges from (x0, y0) to (x1, y1).
+# The direction of every edge is taken with arctan2, so vertical and horizontal edges get
+# their arrowheads too; only edges of zero length have none (returned in the has_arrow mask).
+def arrowHeads(x0, y0, x1, y1, arrowPos, arrowLength, arrowAngle):
+
+    pointx, pointy = x1, y1
+    if arrowPos == 'middle' or arrowPos == 'mid':
+        pointx = x0 + (x1-x0)/2
+        pointy = y0 + (y1-y0)/2
+    # Angle of the edge from the y axis, the wings point back along the edge at +-arrowAngle from it
+    eta = np.degrees(np.arctan2(x1-x0, y1-y0))
+    wing1x = pointx - arrowLength * np.sin(np.radians(eta + arrowAngle))
+    wing1y = pointy - arrowLength * np.cos(np.radians(eta + arrowAngle))
+    wing2x = pointx - arrowLength * np.sin(np.radians(eta - arrowAngle))
+    wing2y = pointy - arrowLength * np.cos(np.radians(eta - arrowAngle))
+    has_arrow = (x0!=x1) | (y0!=y1)
+    return pointx, pointy, wing1x, wing1y, wing2x, wing2y, has_arrow
+
+# Array version of addEdge for many edges at once.
+# start and end are (N, 2) arrays of edge start and end points, the other arguments are as in addEdge.
+# Returns the x and y coordinate arrays of all the edges (and arrowheads) separated by NaN,
+# which plotly draws as gaps, so all the edges can go into a single trace.
+# Every edge takes edgeStride points: the line and a separator, then the arrowhead and a separator.
+edgeStride = 10
+def addEdges(start, end, lengthFrac=1, arrowPos = None, arrowLength=0.025, arrowAngle = 30, dotSize=20):
+
+    start = np.asarray(start, dtype=np.float64).reshape(-1, 2)
+    end = np.asarray(end, dtype=np.float64).reshape(-1, 2)
+    x0, y0 = start[:, 0], start[:, 1]
+    x1, y1 = end[:, 0], end[:, 1]
+    edge_x = np.full((len(start), edgeStride), np.nan)
+    edge_y = np.full((len(start), edgeStride), np.nan)
+
     # Incorporate the fraction of this segment covered by a dot into total reduction
-    length = math.sqrt( (x1-x0)**2 + (y1-y0)**2 )
+    length = np.sqrt( (x1-x0)**2 + (y1-y0)**2 )
     dotSizeConversion = .0565/20 # length units per dot size
     convertedDotDiameter = dotSize * dotSizeConversion
-    lengthFracReduction = convertedDotDiameter / length
-    lengthFrac = lengthFrac - lengthFracReduction
-    
+    lengthFracReduction = convertedDotDiameter / np.where(length > 0, length, np.inf)   # Edges of zero length stay a point
+    fracs = lengthFrac - lengthFracReduction
+
     # If the line segment should not cover the entire distance, get actual start and end coords
-    skipX = (x1-x0)*(1-lengthFrac)
-    skipY = (y1-y0)*(1-lengthFrac)
+    skipX = (x1-x0)*(1-fracs)
+    skipY = (y1-y0)*(1-fracs)
     x0 = x0 + skipX/2
     x1 = x1 - skipX/2
     y0 = y0 + skipY/2
     y1 = y1 - skipY/2
-    
-    # Append line corresponding to the edge
-    edge_x.append(x0)
-    edge_x.append(x1-skipX/2)
-    edge_x.append(None) # Prevents a line being drawn from end of this edge to start of next edge
-    edge_y.append(y0)
-    edge_y.append(y1-skipY/2)
-    edge_y.append(None)
-    
-    # Draw arrow
-    if (not arrowPos == None) and (x0!=x1) and (y1!=y0):
-        
-        # Find the point of the arrow; assume is at end unless told middle
-        pointx = x1
-        pointy = y1
-        eta = math.degrees(math.atan((x1-x0)/(y1-y0)))
-        
-        if arrowPos == 'middle' or arrowPos == 'mid':
-            pointx = x0 + (x1-x0)/2
-            pointy = y0 + (y1-y0)/2
-            
-        # Find the directions the arrows are pointing
-        signx = (x1-x0)/abs(x1-x0)
-        signy = (y1-y0)/abs(y1-y0)
-        
-        # Append first arrowhead
-        dx = arrowLength * math.sin(math.radians(eta + arrowAngle))
-        dy = arrowLength * math.cos(math.radians(eta + arrowAngle))    
-        edge_x.append(pointx)
-        edge_x.append(pointx - signx**2 * signy * dx)
-        edge_x.append(None)
-        edge_y.append(pointy)
-        edge_y.append(pointy - signx**2 * signy * dy)
-        edge_y.append(None)
-        
-        # And second arrowhead
-        dx2 = arrowLength * math.sin(math.radians(eta - arrowAngle))
-        dy2 = arrowLength * math.cos(math.radians(eta - arrowAngle))    
-        edge_x.append(pointx)
-        edge_x.append(pointx - signx**2 * signy * dx2)
-        # edge_x.append(None)
-        edge_y.append(pointy)
-        edge_y.append(pointy - signx**2 * signy * dy2)
-        # edge_y.append(None)
-        edge_x.append(pointx - signx**2 * signy * dx)
-        edge_y.append(pointy - signx**2 * signy * dy)
-    
-    return edge_x, edge_y
-def addEdgemap(start, end, dura_input, edge_x, edge_y,duration_output, lengthFrac=1, arrowPos = None, arrowLength=0.025, arrowAngle = 30, dotSize=20):
-    
-    # Get start and end cartesian coordinates
-    x0, y0 = start
-    x1, y1 = end
-    
-    # Incorporate the fraction of this segment covered by a dot into total reduction
-    
-    
-    # Append line corresponding to the edge
-    edge_x.append(x0)
-    edge_x.append(x1)
-    edge_x.append(None) # Prevents a line being drawn from end of this edge to start of next edge
-    edge_y.append(y0)
-    edge_y.append(y1)
-    edge_y.append(None)
-    for _ in range(3):
-        duration_output.append(dura_input)
-    
-
-    if not arrowPos == None and (x0!=x1) and (y1!=y0):
-        
-        length = math.sqrt( (x1-x0)**2 + (y1-y0)**2 )
-        dotSizeConversion = .0565/20 # length units per dot size
-        convertedDotDiameter = dotSize * dotSizeConversion
-        lengthFracReduction = convertedDotDiameter / length
-        lengthFrac = lengthFrac - lengthFracReduction
-        # Find the point of the arrow; assume is at end unless told middle
-        pointx = x1
-        pointy = y1
-        eta = math.degrees(math.atan((x1-x0)/(y1-y0)))
-        
-        if arrowPos == 'middle' or arrowPos == 'mid':
-            pointx = x0 + (x1-x0)/2
-            pointy = y0 + (y1-y0)/2
-            
-        # Find the directions the arrows are pointing
-        if x1!=x0:
-            signx = (x1-x0)/abs(x1-x0)
-        else:
-            signx = 0
-        signy = (y1-y0)/abs(y1-y0)
-        
-        # Append first arrowhead
-        dx = arrowLength * math.sin(math.radians(eta + arrowAngle))
-        dy = arrowLength * math.cos(math.radians(eta + arrowAngle))    
-        edge_x.append(pointx)
-        edge_x.append(pointx - signx**2 * signy * dx)
-        edge_x.append(None)
-        edge_y.append(pointy)
-        edge_y.append(pointy - signx**2 * signy * dy)
-        edge_y.append(None)
-        
-#         # And second arrowhead
-        dx2 = arrowLength * math.sin(math.radians(eta - arrowAngle))
-        dy2 = arrowLength * math.cos(math.radians(eta - arrowAngle))    
-        edge_x.append(pointx)
-        edge_x.append(pointx - signx**2 * signy * dx2)
-#         edge_x.append(None)
-        edge_y.append(pointy)
-        edge_y.append(pointy - signx**2 * signy * dy2)
-#         edge_y.append(None)
-        
-#         edge_x.append(pointx - signx**2 * signy * dx)
-#         edge_y.append(pointy - signx**2 * signy * dy)
-        edge_x.append(None)
-        edge_y.append(None)
-        for _ in range(6):
-            duration_output.append(dura_input)
-
-    
-    return edge_x, edge_y, duration_output
\ No newline at end of file
+
+    # Line corresponding to the edge
+    edge_x[:, 0], edge_x[:, 1] = x0, x1-skipX/2
+    edge_y[:, 0], edge_y[:, 1] = y0, y1-skipY/2
+
+    # Arrowhead: tip, first wing, separator, tip, second wing, back to the first wing
+    if not arrowPos == None:
+        pointx, pointy, wing1x, wing1y, wing2x, wing2y, arrow = arrowHeads(x0, y0, x1, y1, arrowPos, arrowLength, arrowAngle)
+        edge_x[arrow, 3], edge_x[arrow, 4], edge_x[arrow, 6], edge_x[arrow, 7], edge_x[arrow, 8] = \
+            pointx[arrow], wing1x[arrow], pointx[arrow], wing2x[arrow], wing1x[arrow]
+        edge_y[arrow, 3], edge_y[arrow, 4], edge_y[arrow, 6], edge_y[arrow, 7], edge_y[arrow, 8] = \
+            pointy[arrow], wing1y[arrow], pointy[arrow], wing2y[arrow], wing1y[arrow]
+
+    return edge_x.ravel(), edge_y.ravel()
+
+# Array version of addEdgemap, start and end are (N, 2) arrays of (lat, lon) points.
+# Returns the lat and lon arrays of all the edges separated by NaN, mapEdgeStride points per edge:
+# the line and a separator, then the two arrowhead wings each followed by a separator.
+# The hover text of addEdgemap is the per edge value repeated mapEdgeStride times.
+mapEdgeStride = 9
+def addEdgesmap(start, end, arrowPos = None, arrowLength=0.025, arrowAngle = 30):
+
+    start = np.asarray(start, dtype=np.float64).reshape(-1, 2)
+    end = np.asarray(end, dtype=np.float64).reshape(-1, 2)
+    x0, y0 = start[:, 0], start[:, 1]
+    x1, y1 = end[:, 0], end[:, 1]
+    edge_x = np.full((len(start), mapEdgeStride), np.nan)
+    edge_y = np.full((len(start), mapEdgeStride), np.nan)
+
+    # Line corresponding to the edge
+    edge_x[:, 0], edge_x[:, 1] = x0, x1
+    edge_y[:, 0], edge_y[:, 1] = y0, y1
+
+    # Arrowhead: tip and first wing, then tip and second wing
+    if not arrowPos == None:
+        pointx, pointy, wing1x, wing1y, wing2x, wing2y, arrow = arrowHeads(x0, y0, x1, y1, arrowPos, arrowLength, arrowAngle)
+        edge_x[arrow, 3], edge_x[arrow, 4], edge_x[arrow, 6], edge_x[arrow, 7] = pointx[arrow], wing1x[arrow], pointx[arrow], wing2x[arrow]
+        edge_y[arrow, 3], edge_y[arrow, 4], edge_y[arrow, 6], edge_y[arrow, 7] = pointy[arrow], wing1y[arrow], pointy[arrow], wing2y[arrow]
+
+    return edge_x.ravel(), edge_y.ravel()
@@ -0,0 +1,105 @@
+import networkx as nx
+import numpy as np
+from scipy import sparse
+
+# Call graph of the CDR rows of a dataframe, stored as sparse adjacency matrices.
+# Built with vectorised code from the encoded Caller_node/Receiver_node columns, rows are
+# callers and columns receivers, parallel calls are summed into the edge weights.
+# Node numbers are the ones of preprocess_data, so they match the columns of df.
+
+
+class CallGraph:
+
+    def __init__(self, df, num_nodes=None):
+        cdr = df[df['Receiver_node'] != -1]
+        caller = cdr['Caller_node'].values
+        receiver = cdr['Receiver_node'].values
+        if num_nodes is None:
+            num_nodes = int(max(caller.max(), receiver.max())) + 1 if len(cdr) else 0
+        shape = (num_nodes, num_nodes)
+        self.counts = sparse.coo_matrix((np.ones(len(cdr)), (caller, receiver)), shape=shape).tocsr()
+        self.durations = sparse.coo_matrix((cdr['Duration'].values.astype(float), (caller, receiver)), shape=shape).tocsr()
+        self.undirected = (self.counts + self.counts.T).tocsr()    # Adjacency ignoring the direction of the calls
+        # Phone number of every node and whether the node takes part in a call
+        self.numbers = np.zeros(num_nodes, dtype=np.int64)
+        self.numbers[caller] = cdr['Caller'].values
+        self.numbers[receiver] = cdr['Receiver'].values
+        self.present = np.zeros(num_nodes, dtype=bool)
+        self.present[caller] = True
+        self.present[receiver] = True
+
+    def __len__(self):
+        return self.counts.shape[0]
+
+    def nodes(self):
+        return np.nonzero(self.present)[0]
+
+    # Returns the (caller, receiver) node arrays of the distinct edges.
+    def edges(self):
+        edges = self.counts.tocoo()
+        return edges.row, edges.col
+
+    def out_degree(self):
+        return np.diff(self.counts.indptr)
+
+    def in_degree(self):
+        return self.counts.getnnz(axis=0)
+
+    # Returns the nodes connected to node by a call in either direction.
+    def neighbours(self, node):
+        return self.undirected.indices[self.undirected.indptr[node]:self.undirected.indptr[node+1]]
+
+    # Returns the node of every phone number, -1 for numbers without calls in the graph.
+    def node_of(self, numbers):
+        nodes = self.nodes()
+        known = self.numbers[nodes]     # Sorted, nodes are numbered in the order of the phone numbers
+        numbers = np.asarray(numbers, dtype=np.int64)
+        if len(nodes) == 0:
+            return np.full(len(numbers), -1)
+        positions = np.minimum(np.searchsorted(known, numbers), len(nodes) - 1)
+        return np.where(known[positions] == numbers, nodes[positions], -1)
+
+    # Returns a networkx DiGraph of the distinct edges, e.g. as the input of a layout.
+    def to_networkx(self):
+        G = nx.DiGraph()
+        G.add_edges_from(zip(*(nodes.tolist() for nodes in self.edges())))
+        return G
+
+
+# Level of detail view of the calls: the parallel calls of every (caller, receiver) pair
+# collapsed into one weighted edge, with the number of calls, total and mean duration and
+# the first and last Epoch. With merge_directions the calls of both directions of a pair
+# go into the same edge (caller is then the smaller node). Arrays are aligned by edge.
+class EdgeTable:
+
+    def __init__(self, df, merge_directions=False):
+        cdr = df[df['Receiver_node'] != -1]
+        caller = cdr['Caller_node'].values.astype(np.int64)
+        receiver = cdr['Receiver_node'].values.astype(np.int64)
+        if merge_directions:
+            caller, receiver = np.minimum(caller, receiver), np.maximum(caller, receiver)
+        num_nodes = int(receiver.max(initial=caller.max(initial=-1))) + 1
+        keys, edge = np.unique(caller * num_nodes + receiver, return_inverse=True)
+        edge = edge.ravel()
+        self.merge_directions = merge_directions
+        self.caller = keys // max(num_nodes, 1)
+        self.receiver = keys % max(num_nodes, 1)
+        self.count = np.bincount(edge, minlength=len(keys))
+        self.total_duration = np.bincount(edge, weights=cdr['Duration'].values.astype(float), minlength=len(keys))
+        self.mean_duration = self.total_duration / np.maximum(self.count, 1)
+        # First and last call of every edge from the calls sorted by edge, then time
+        epoch = cdr['Epoch'].values
+        order = np.lexsort((epoch, edge))
+        ends = np.cumsum(self.count)
+        self.first = epoch[order][ends - self.count]
+        self.last = epoch[order][ends - 1]
+
+    def __len__(self):
+        return len(self.count)
+
+    # Returns the positions of the budget heaviest edges (by number of calls, then total duration), all if there are fewer.
+    def top(self, budget):
+        if len(self) <= budget:
+            return np.arange(len(self))
+        order = np.lexsort((self.total_duration, self.count))
+        return np.sort(order[-budget:])
@@ -0,0 +1,76 @@
+import networkx as nx
+import numpy as np
+from scipy import sparse
+
+# Communities of the call graph for the community level of the network plot.
+# Found once per dataset by label propagation on the undirected call graph weighted by
+# the number of calls: every node repeatedly takes the label with the largest total
+# weight among its neighbours until no node can improve. All nodes are updated at once
+# with sparse matrix and sorting operations; only a random half of them moves in each
+# round, which keeps the labels from oscillating between two states.
+
+
+# Returns the label of every node of the CallGraph after label propagation.
+def label_propagation(graph, max_iter=100, seed=0):
+    n = len(graph)
+    labels = np.arange(n)
+    edges = graph.undirected.tocoo()
+    rows, cols, weights = edges.row.astype(np.int64), edges.col, edges.data
+    rng = np.random.RandomState(seed)
+    for _ in range(max_iter):
+        # Total weight of every (node, neighbour label) pair
+        keys, pair = np.unique(rows * n + labels[cols], return_inverse=True)
+        totals = np.bincount(pair.ravel(), weights=weights)
+        nodes, candidates = keys // n, keys % n
+        # Heaviest label of every node, the smallest label among equally heavy ones
+        order = np.lexsort((candidates, -totals, nodes))
+        best = order[np.r_[True, nodes[order][1:] != nodes[order][:-1]]]
+        # Weight of the label the node has now, 0 if none of its neighbours has it
+        current = np.zeros(n)
+        held = candidates == labels[nodes]
+        current[nodes[held]] = totals[held]
+        improves = totals[best] > current[nodes[best]]
+        if not improves.any():
+            break
+        moving = improves & (rng.rand(len(best)) < 0.5)
+        labels[nodes[best][moving]] = candidates[best][moving]
+    return labels
+
+
+class Communities:
+
+    def __init__(self, graph, max_iter=100, seed=0):
+        nodes = graph.nodes()
+        _, dense, sizes = np.unique(label_propagation(graph, max_iter, seed)[nodes], return_inverse=True, return_counts=True)
+        # Communities are numbered from the largest one down
+        rank = np.empty(len(sizes), dtype=np.int64)
+        rank[np.argsort(-sizes, kind='mergesort')] = np.arange(len(sizes))
+        self.count = len(sizes)
+        self.labels = np.full(len(graph), -1, dtype=np.int64)   # Community of every node, -1 for nodes without calls
+        self.labels[nodes] = rank[dense.ravel()]
+        order = np.argsort(self.labels[nodes], kind='mergesort')
+        self.members = nodes[order]
+        self.start = np.searchsorted(self.labels[self.members], np.arange(self.count + 1))
+        self.size = np.diff(self.start)
+        self._positions = None
+
+    def members_of(self, label):
+        return self.members[self.start[label]:self.start[label+1]]
+
+    # Returns the community x community matrix of the number of calls (of graph, e.g. a filtered CallGraph).
+    def quotient(self, graph):
+        n = min(len(graph), len(self.labels))
+        known = np.nonzero(self.labels[:n] >= 0)[0]
+        indicator = sparse.csr_matrix((np.ones(len(known)), (known, self.labels[known])), shape=(len(graph), self.count))
+        return (indicator.T @ graph.counts @ indicator).tocsr()
+
+    # Position of every community, a force directed layout of the quotient graph computed once.
+    def positions(self, graph):
+        if self._positions is None:
+            calls = self.quotient(graph).tocoo()
+            G = nx.Graph()
+            G.add_nodes_from(range(self.count))
+            G.add_weighted_edges_from((a, b, w) for a, b, w in zip(calls.row.tolist(), calls.col.tolist(), calls.data.tolist()) if a != b)
+            layout = nx.spring_layout(G, weight='weight', seed=0)
+            self._positions = np.array([layout[c] for c in range(self.count)]).reshape(-1, 2)
+        return self._positions
@@ -11,9 +11,10 @@ import dash_bootstrap_components as dbc
 import dash_draggable
 from ml_layout import *
 from StatAnom_layout import *
+from dataset import load_dataset
 
 
-df = pd.read_csv('./data/final_data.csv')
+df = load_dataset()
 
 default_duration_slider_val = [0, 100]
 
@@ -102,6 +103,9 @@ dash_layout2 = html.Div(children=[
 				                                                                                        multiple=False
 				                                                                                    ),
 				                                     html.Div(id='output-data-upload'),
+				                                     dcc.Interval(id='upload-interval', interval=500, disabled=True),
+				                                     html.Div(id='upload-key', style={'display': 'none'}),
+				                                     html.Div(id='dataset-version', style={'display': 'none'}),
 
 				                                     dbc.Tooltip(
 													            "Click to toggle Filters",
@@ -178,8 +182,8 @@ dash_layout2 = html.Div(children=[
                                                                                         ),
                                                                                             dcc.DatePickerSingle(
                                                                                                 id='date-picker1',
-                                                                                                min_date_allowed=df['Date'].min(),
-                                                                                                max_date_allowed=df['Date'].max(),
+                                                                                                min_date_allowed=df['Timestamp'].min().date(),
+                                                                                                max_date_allowed=df['Timestamp'].max().date(),
                                                                                                 initial_visible_month=dt(2020, 6, 5),
                                                                                                 date=str(dt(2020, 6, 17, 0, 0, 0)),
                                                                                                 display_format='DD-MMM-YY',
@@ -199,8 +203,8 @@ dash_layout2 = html.Div(children=[
                                                                                         ),
                                                                                         dcc.DatePickerSingle(
                                                                                             id='date-picker2',
-                                                                                            min_date_allowed=df['Date'].min(),
-                                                                                            max_date_allowed=df['Date'].max(),
+                                                                                            min_date_allowed=df['Timestamp'].min().date(),
+                                                                                            max_date_allowed=df['Timestamp'].max().date(),
                                                                                             initial_visible_month=dt(2020, 6, 5),
                                                                                             date=str(dt(2020, 6, 17, 0, 0, 0)),
                                                                                             display_format='DD-MMM-YY',
@@ -485,7 +489,15 @@ dash_layout2 = html.Div(children=[
                                                                         x -> Selected Caller
                                                                                 Diamond Cross -> Selected Receiver
                                                                                 o -> Other
-                                                                                """),] ,id='network-plot-div'),
+                                                                                """),
+                                                                        dcc.Checklist(
+                                                                            id='network-lod',
+                                                                            options=[{'label': ' Aggregate parallel calls', 'value': 'aggregate'},
+                                                                                     {'label': ' Merge call directions', 'value': 'merge'},
+                                                                                     {'label': ' Communities', 'value': 'communities'}],
+                                                                            value=[],
+                                                                            labelStyle={'display': 'inline-block', 'margin-right': '15px'}),
+                                                                        html.Div(id='expanded-community', style={'display': 'none'}),] ,id='network-plot-div'),
                                                                                             ])])),
                                                                         ###### 
 
@@ -536,9 +548,18 @@ dash_layout2 = html.Div(children=[
                                                                                             id='draggable-map-div',
                                                                                             className='handle',
                                                                                             children=[
+                                                                         html.Div([
+                                                                         dcc.RadioItems(
+                                                                            id='map-mode',
+                                                                            options=[{'label': ' Towers', 'value': 'towers'},
+                                                                                     {'label': ' Call density', 'value': 'calls'},
+                                                                                     {'label': ' Duration density', 'value': 'duration'},
+                                                                                     {'label': ' IPDR volume density', 'value': 'volume'}],
+                                                                            value='towers',
+                                                                            labelStyle={'display': 'inline-block', 'margin-right': '15px'}),
                                                                          dcc.Graph(
                                                                             id='map-plot'
-                                                                        )])])
+                                                                        )], id='map-view')])])
 
 
                                                                      ],id='plot-area'),
@@ -1,10 +1,10 @@
  ########################################################### Import Libraries ###################################################
 import pandas as pd
-import base64
-import io
 #from Crypto.Protocol.KDF import PBKDF2
 import numpy as np
 import json
+import os
+import threading
 import networkx as nx
 import plotly.graph_objects as go
 import plotly.figure_factory as ff
@@ -17,6 +17,7 @@ import dash_html_components as html
 import dash_daq as daq
 import dash_table
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 from datetime import datetime as dt
 from stats import *
 import pygraphviz as pgv
@@ -40,8 +41,20 @@ from sklearn.covariance import EllipticEnvelope
 from sklearn.ensemble import IsolationForest
 from sklearn.neighbors import LocalOutlierFactor
 ########################################################## Import functions for Breadth First Search ##########################
-from addEdge import addEdge,addEdgemap
-from BFSN import bfs
+from addEdge import addEdges,edgeStride,addEdgesmap,mapEdgeStride
+from BFSN import bfs, Components
+from models import ModelRegistry, outliers
+from ml_jobs import FitError, ScoringPool
+from features import feature_matrix, feature_hash, feature_columns, suspicious_towers, suspicious_users
+from callgraph import CallGraph, EdgeTable
+from communities import Communities
+from geocells import TowerCells
+from session_store import SessionStore
+from preprocess import encode_nodes, time_columns, sort_by_time, date_slice, dataset_hash
+from dataset import load_dataset, date_format, time_format
+from ingest import UploadedDatasets, upload_key
+from tower_index import TowerIndex
+from graph_layout import LayoutCache
 
 
 
@@ -57,25 +70,30 @@ external_stylesheets = [dbc.themes.SANDSTONE,'https://codepen.io/dadamson/pen/vP
 
 
 # Load  Data
-df = pd.read_csv('./data/final_data.csv')
+# Uploads last for the server run: the gunicorn master (parent of the workers), or this process when run directly
+server_run = os.environ.get('CDR_RUN_ID') or (os.getpid() if __name__ == '__main__' else os.getppid())
+uploads = UploadedDatasets(server_run) # Uploaded datasets shared by the workers, see section 9.1.2.
+version = uploads.current() # Uploaded dataset to start from, None for the bundled one
+df = uploads.load(version) if version else load_dataset() # Typed Feather file from dataset.py if converted, else final_data.csv
 #df2 = pd.read_csv('./data/ipdr_data.csv')
 towers=pd.read_csv('./data/towers_min.csv') #Data for Cell Towers
 towers_add = pd.read_csv('./data/towers_final.csv')
-tower_mean=df.groupby(['TowerID'])['Duration'].mean()
-tower_std=df.groupby(['TowerID'])['Duration'].std()
+store = SessionStore() # Server side store for the filtered dataframe, see section 9.1.
+models = ModelRegistry() # Anomaly detectors fitted once per dataset for the ML modes, see section 9.1.
+scoring_pool = ScoringPool(models) # Process pool fitting the detectors in the background
 #### Create App ###
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 app.title = 'CDR/IPDR Analyser'
 
-suspicious_towers=['40478-38009-10112','40478-41081-10962474','40458-2131-13052','40467-1164-10423','40458-3091-20260037','40493-903-38141']
-suspicious_users=[9340552262,8824403719,8803318491,8007977426,8650807946,9074636167]
-towers["Suspicious"]=towers["TowerID"].apply(lambda x :1 if x in suspicious_towers else 0)
+towers["Suspicious"]=towers["TowerID"].isin(suspicious_towers).astype(int) # suspicious_towers and suspicious_users are in features.py
+tower_index = TowerIndex(towers) # Spatial index for the radius filter and nearest tower lookups
+tower_cells = TowerCells(tower_index) # Geohash cell of every tower for the density mode of the map plot
+tower_address = towers_add.drop_duplicates('TowerID').set_index('TowerID')['Address']
 
 # 3. Setting Default Variables for various Filters ####
 default_duration_slider_val = [0, 100]    ## Also needed in dash_layout.py
 default_time_slider_val = [0,48]
 default_caller_receiver_val = 3
-date_format='%d-%m-%Y'
 
 
 
@@ -101,6 +119,8 @@ for i in range(0, 48):
             times[i+1] = {'label': "".join(time_str),
                         "style": {"transform": "rotate(-90deg) translateY(-15px)",'display':'none'}}
 
+time_slot = 1800 # Seconds between two marks of the time slider
+
 ## 4.2. Generating marks for duration slider
 durations = {}
 for i in range(0, int(df['Duration'].max()), 10):
@@ -108,11 +128,16 @@ for i in range(0, int(df['Duration'].max()), 10):
 
 ## 4.3. Color Map for Edges based on Duration of call (see Section 7.3.)
 cmap = cm.get_cmap('coolwarm')
+edge_color_bins = 16 # Number of edge colours (and edge traces) in the network plot
+edge_budget = 3000 # Largest number of edges drawn in the network plot, above it parallel calls are aggregated (see 7.3.)
+community_view_nodes = 500 # Above this number of nodes the network plot opens at the community level (see 7.6.)
+community_spread = 60 # Distance between the communities (and nodes of the expanded one) in the community level
 
 
 
 # 5. Variables for Graph Functions
 coords_to_node = {}  # Dictionary that stores coordinates to node number
+coords_to_community = {}  # Dictionary that stores coordinates to community of the community level (see 7.6.)
 node_to_num = {}  # Dictionary that stores node number to phone number
 num_to_node = {}  #Dictionary that stores numbers to node
 data_columns = ["Caller", "Receiver", "Date",
@@ -126,50 +151,60 @@ data_columns_ipdr = ["Caller","App_name","Private IP","Private Port", "Public IP
     "Duration", "TowerID", "Uplink Volume","Downlink Volume","Total Volume","I_RATTYPE"]
 
 
-ports_to_apps = {'DEST PORT':'App','0':'nan','5223':'WhatsApp','5228':'WhatsApp', '4244':'WhatsApp', '5222':'WhatsApp', '5242':'WhatsApp','443_':'Skype','443':'SSL',\
-    '3478-3481':'Skype','49152-65535':'Skype','80':'Web connection','8080':'Web Connection', \
-        '8081': 'Web Connection', '993':'IMAP', '143':'IMAP', '8024':'iTunes', '8027':'iTunes', '8013':'iTunes', \
-            '8017':'iTunes', '8003':'iTunes', '7275':'iTunes', '8025':'iTunes', '8009':'iTunes',\
-                '58128': 'Xsan', '51637':'Xsan', '61076':'Xsan','40020':'Microsoft Online Games', '40017':'Microsoft Various Games', \
-                    '40023':'Microsoft Online Games',\
-                    '40019':'Microsoft Online Games', '40001':'Microsoft Online Games', '40004':'Microsoft Online Games', \
-                        '40034':'Microsoft Online Games', '40031':'Microsoft Online Games', '40029':'Microsoft Online Games',\
-                              '40005':'Microsoft Online Games', '40026': 'Microsoft Online Games', '40008': 'Microsoft Online Games',\
-                                  '40032':'Microsoft Online Games'}   # did not took '443':'SSL, Web connection' to avoid double 443.
-
 
 
 
-# 6. Function to set color scale of edges
-viridis = cm.get_cmap('viridis', 12)
 
+# 6. Preprocessing of the whole dataset. Edges are coloured by duration buckets of cmap (see 7.5.1.), no per row colour is kept.
 def preprocess_data(df):
-    # nodes
-    l=df['Receiver'].unique()
-    l=l[l!=20000] # to remove occurrences of 20000
-    nodes = np.union1d(df['Caller'].unique(),l )
-    # Define Color
-    df['Dura_color'] = (df['Duration']/df['Duration'].max()).apply(viridis)
-    
-    df['Date'] = df['Date'].apply(lambda x: pd.to_datetime(x,format=date_format)).dt.date
-
-
-    df['Caller_node'] = df['Caller'].apply(
-        lambda x: list(nodes).index(x))  # Caller Nodes
-    
-#    df['Receiver_node'] = df['Receiver'].apply(lambda x: list(nodes).index(x))
-    df['Receiver_node'] = df['Receiver'].apply(lambda x: list(nodes).index(x) if x!=20000 else -1)
-
-    df['IMEI_node'] = df['Caller'].apply(lambda x: list(nodes).index(x) if x!=20000 else -1)
-    df['App_name'] = df['DEST PORT'].apply(lambda x:ports_to_apps[str(x)] if (ports_to_apps[str(x)]!='nan') else None)
-
-    coords_to_node.clear()
-    num_to_node.clear()
-    node_to_num.clear()
-
-
-
-preprocess_data(df)
+    # Vectorised stages from preprocess.py
+    # Date and Time columns used by the filters and tables, derived from the typed Timestamp (see dataset.py)
+    df['Date'] = df['Timestamp'].dt.date
+    df['Time'] = df['Timestamp'].dt.strftime(time_format)
+    time_columns(df)  # Epoch and Time_sec integer columns used by the filters
+    df = sort_by_time(df)  # Kept sorted by Epoch so date ranges are sliced with a binary search
+    df['Row_id'] = np.arange(len(df))  # Position in df, kept by the filtered frames to look up per row caches (e.g. ML scores)
+
+    # Caller_node, Receiver_node (-1 for IPDR rows) and IMEI_node in one pass over the sorted nodes
+    encode_nodes(df)
+    # Dense tower codes into the tower_index arrays
+    df['Tower_code'] = tower_index.encode(df['TowerID'])
+    return df
+
+## 6.1. The preprocessed dataset and everything derived from it as a whole.
+# Replaced in a single assignment when an upload is published (see sync_dataset), so a callback that
+# took it once sees the frame, its keys, features and tower statistics of one and the same dataset.
+class LoadedDataset:
+
+    def __init__(self, df, version=None):
+        self.version = version  # Version of the uploaded dataset (ingest.py), None for the bundled one
+        self.tag = version or 'bundled'  # Tag of the frames filtered from it in the session store
+        self.df = preprocess_data(df)
+        self.key = dataset_hash(self.df)  # Key of the caches that depend on the whole dataset (e.g. the network layout)
+        self.ml_X = feature_matrix(self.df, tower_index, suspicious_users)  # float32 features of every row for the ML modes
+        self.ml_feature_key = '+'.join(feature_columns) + '-' + self.ml_X.dtype.name
+        self.ml_key = feature_hash(self.ml_X)  # Key of the fitted detectors, changes with any feature value
+        self.tower_mean, self.tower_std = tower_index.duration_stats(self.df)  # Per tower duration statistics used by plot_map
+
+
+dataset = LoadedDataset(df, version)
+del df  # Callbacks read the dataset they took from sync_dataset, never a module level frame
+dataset_lock = threading.Lock()
+
+# Returns the current dataset, reloading it first when another worker (or this one) has published a newer upload.
+def sync_dataset():
+    global dataset
+    version = uploads.current()
+    if version is None or version == dataset.version:
+        return dataset
+    with dataset_lock:
+        if version != dataset.version:
+            loaded = LoadedDataset(uploads.load(version), version)
+            coords_to_node.clear()
+            num_to_node.clear()
+            node_to_num.clear()
+            dataset = loaded
+    return dataset
 
 
 #### Plots ####
@@ -178,16 +213,46 @@ preprocess_data(df)
 # 7. Main Plot Functions 
 fig = go.Figure() # Defining the main figure
 pos = {}
+layout_cache = LayoutCache() # Network layout of the whole dataset, reused by every filtered plot
+
+# Call graph of the whole dataset, the input of the cached global layout.
+def full_graph(data):
+    return CallGraph(data.df).to_networkx()
+
+# Communities of the whole dataset for the community level of the network plot (see 7.6.), found once per dataset
+community_cache = {}  # dataset key -> (Communities, CallGraph of df)
+def dataset_communities(data):
+    if data.key not in community_cache:
+        graph = CallGraph(data.df)
+        community_cache.clear()
+        community_cache[data.key] = (Communities(graph), graph)
+    return community_cache[data.key]
+
+# Positions of the nodes of G (a filtered graph) for datasets too large for the global graphviz layout.
+# Every node starts at the place of its community in the community level and a spring layout of G alone
+# spreads them, so the cost depends on the filtered graph only.
+def filtered_layout(G, data):
+    nodes = list(G)
+    if not nodes:
+        return {}
+    communities, full = dataset_communities(data)
+    centres = communities.positions(full)
+    start = centres[communities.labels[nodes]] + np.random.RandomState(0).uniform(-0.05, 0.05, (len(nodes), 2))
+    layout = nx.spring_layout(G.to_undirected(), pos=dict(zip(nodes, start)), seed=0, iterations=30,
+                              scale=community_spread * np.sqrt(len(nodes)))
+    return {node: tuple(layout[node]) for node in nodes}
 
 ## 7.1. Returns the figure for geographical map from input Dataframe.
-def plot_map(filtered_df):
-
-    new_df=pd.merge(filtered_df,towers[['lat','lon','TowerID']],on='TowerID')
-    towers_deviation=new_df.groupby(['TowerID'])[['Duration']].apply(lambda x : (x.mean()-tower_mean[x.name])/tower_std[x.name] ).reset_index()
-    towers_deviation['Duration']=towers_deviation['Duration'].apply(lambda x : max(x,0))
-    node_x=towers_deviation['TowerID'].apply(lambda x : towers[towers['TowerID']==x]['lat'].unique()[0])
-    node_y=towers_deviation['TowerID'].apply(lambda x : towers[towers['TowerID']==x]['lon'].unique()[0])
-    people=dict(type='scattermapbox',lat=node_x,lon=node_y,mode='markers',marker=go.scattermapbox.Marker( size=30*pow(0.3,towers_deviation['Duration'])))
+def plot_map(filtered_df, data):
+
+    # Mean duration of each active tower, compared to its mean over the whole data (LoadedDataset statistics)
+    sums, counts = tower_index.duration_sums(filtered_df['Tower_code'].values, filtered_df['Duration'].values.astype(float))
+    active = np.nonzero(counts)[0]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        towers_deviation = np.maximum((sums[active]/counts[active] - data.tower_mean[active])/data.tower_std[active], 0)
+    node_x = tower_index.lat[active]
+    node_y = tower_index.lon[active]
+    people=dict(type='scattermapbox',lat=node_x,lon=node_y,mode='markers',marker=go.scattermapbox.Marker( size=30*np.power(0.3,towers_deviation)))
     fig=go.Figure(people,layout={
         'mapbox_style':'open-street-map',
         'margin': dict(l = 0, r = 0, t = 0, b = 0),
@@ -211,52 +276,67 @@ def plot_map(filtered_df):
     return fig
 
 
+## 7.1.1. Returns the density map of the calls, call duration or IPDR volume of the filtered records per geohash cell.
+density_metrics = {'calls': 'Calls', 'duration': 'Total duration', 'volume': 'IPDR volume'}
+def plot_density(filtered_df, metric):
+    codes = filtered_df['Tower_code'].values
+    ipdr = filtered_df['Receiver'].values == 20000
+    cdr = ~ipdr
+    # Calls and their duration from the CDR rows, data volume from the IPDR sessions
+    values = {'calls': tower_cells.aggregate(codes[cdr]).astype(np.int64),
+              'duration': tower_cells.aggregate(codes[cdr], filtered_df['Duration'].values[cdr].astype(float)),
+              'volume': tower_cells.aggregate(codes[ipdr], filtered_df['Total Volume'].values[ipdr].astype(float))}
+    cells = np.nonzero(tower_cells.aggregate(codes))[0]  # Only the cells with records (of either kind) are sent
+    hover_list = [tower_cells.names[cell] + ''.join('<br>' + density_metrics[name] + ': ' + str(round(values[name][cell], 2))
+                                                   for name in density_metrics) for cell in cells.tolist()]
+    fig=go.Figure(go.Densitymapbox(lat=tower_cells.lat[cells],lon=tower_cells.lon[cells],z=values[metric][cells],radius=25,
+                                   colorscale='Viridis',hovertext=hover_list,hoverinfo='text'),layout={
+        'mapbox_style':'open-street-map',
+        'margin': dict(l = 0, r = 0, t = 0, b = 0),
+        'mapbox':dict(
+            bearing=0,
+            center=dict(
+                lat=23.2599,
+                lon=77.4126
+            ),
+            pitch=0,
+            zoom=10,
+        )},
+    )
+    fig.update_layout(width=800)
+    return fig
+
+
 #Plot trace
 def plot_movement(df,selected_numbers):
     data=[]
     colors=['#636EFA', '#EF553B', '#00CC96', '#AB63FA', '#FFA15A', '#19D3F3', '#FF6692', '#B6E880', '#FF97FF', '#FECB52']
-    color_no=0
-    df=pd.merge(df,towers[['lat','lon','TowerID']],on='TowerID')
-    for number in selected_numbers:
-        
-        df['Date']=pd.to_datetime(df['Date'],format='%d-%m-%Y')
-        #df=df[df['Date'].isin(pd.date_range('2020/06/05','2020/06/06'))].sort_values(['Date','Time']).reset_index()
-
-        
-        filtered_df=df[df['Caller']==number].sort_values(['Date','Time']).reset_index()
-        all_lat=[]
-        all_lon=[]
-        locs=[]
-        duration_hover=[]
-        duration_output=[]
-
-        l1 = filtered_df['Date'].dt.date.apply(str) + ' '+ filtered_df['Time'].apply(str)
-        for i in range(len(l1)):
-            l1[i] =pd.to_datetime(l1[i],format='%Y-%m-%d %H:%M:%S')
-
-        for i in range(len(l1)-1):
-            x=l1[i+1]-l1[i]
-            duration_hover.append(x)
-
-        
-        dura_op=[]  # Will hold str(transitduration) to be hovered per edge
-        for i in range(len(duration_output)):
-            dura_op.append(str(duration_output[i]))
-        
-            
-        for (index,row) in filtered_df.iterrows():
-            locs.append([row['lat'],row['lon']])
-
-        for i in range(len(locs)-1):
-            all_lat,all_lon,duration_output=addEdgemap(locs[i],locs[i+1],duration_hover[i],all_lat,all_lon,duration_output, 0.7, "end",0.009, 30, 10) 
-            data.append(go.Scattermapbox(lat=all_lat,lon=all_lon,mode = "lines",hovertext=duration_output,marker=go.scattermapbox.Marker(
-                    size=17,
-                    color=colors[color_no],
-                    opacity=1
-                ),
-            ))
-        color_no+=1
-        color_no%=len(colors)
+    selected_numbers=list(dict.fromkeys(selected_numbers))
+    # Events of all the selected subscribers at known towers, sorted by subscriber and time in one go
+    moves=df[df['Caller'].isin(selected_numbers).values & (df['Tower_code'].values>=0)].sort_values(['Caller','Epoch'],kind='mergesort')
+    callers=moves['Caller'].values
+    codes=moves['Tower_code'].values
+    locs=np.column_stack([tower_index.lat[codes],tower_index.lon[codes]])
+
+    # A hop joins two consecutive events of the same subscriber, its duration is the time between them
+    hops=np.flatnonzero(callers[1:]==callers[:-1])
+    hop_callers=callers[hops]
+    duration_hover=pd.to_timedelta(np.diff(moves['Epoch'].values)[hops],unit='s').astype(str)
+    all_lat,all_lon=addEdgesmap(locs[hops],locs[hops+1],"end",0.009,30)
+    duration_output=np.repeat(np.asarray(duration_hover,dtype=object),mapEdgeStride)
+
+    # One trace per subscriber, its hops are a contiguous block of the buffers
+    for color_no,number in enumerate(selected_numbers):
+        first,last=np.searchsorted(hop_callers,number,'left'),np.searchsorted(hop_callers,number,'right')
+        if first==last:
+            continue
+        block=slice(first*mapEdgeStride,last*mapEdgeStride)
+        data.append(go.Scattermapbox(lat=all_lat[block],lon=all_lon[block],mode = "lines",hovertext=duration_output[block],marker=go.scattermapbox.Marker(
+                size=17,
+                color=colors[color_no%len(colors)],
+                opacity=1
+            ),
+        ))
     fig=go.Figure(data,layout={
         'mapbox_style':'open-street-map',
         'showlegend':False,
@@ -277,9 +357,10 @@ def plot_movement(df,selected_numbers):
 
 ## 7.2. Main function to get the Figure for the Graph of Calls.
 # Plot Graph of calls
-def plot_network(df, srs, scs):
+# aggregate collapses parallel calls into weighted edges (always done above edge_budget calls), merge_directions
+# also merges both directions of a pair, edge_table is the callgraph.EdgeTable of df if already built.
+def plot_network(data, df, srs, scs, node_stats=None, graph=None, aggregate=False, merge_directions=False, edge_table=None):
 
-    G = nx.DiGraph()  # networkX Graph
 
     # Reciever Nodes
     df=df[df['Receiver_node']!=-1]
@@ -291,54 +372,103 @@ def plot_network(df, srs, scs):
     if scs != 'None':
         for p in scs:
             selected_callers.append(int(p))
-    def make_graph(x):
-            G.add_edge(x["Caller_node"], x["Receiver_node"])
-
-    df.apply(make_graph, axis=1)  # Make a graph
-    pos = nx.nx_agraph.pygraphviz_layout(G)  # Position of Points
+    if graph is None:
+        graph = CallGraph(df)  # Sparse call graph from callgraph.py
+    G = graph.to_networkx()  # networkX Graph of the distinct edges, input of the layout
+    if len(dataset_communities(data)[1].nodes()) > community_view_nodes:
+        pos = filtered_layout(G, data)  # Large dataset: only the filtered graph is laid out (see 7.6.)
+    else:
+        pos = layout_cache.positions(data.key, G, lambda: full_graph(data))  # Position of Points, from the cached layout
+    if not pos:
+        return network_figure([])  # No calls left (e.g. only IPDR rows), empty plot as before
 
-    edge_trace = [] # Add Edges to Plot
-    symbols = []
 ## 7.3. Adds the caller and reciever edge information to each entry. 
-    def add_coords(x):
-        x0, y0 = pos[x['Caller_node']]
-        x1, y1 = pos[x['Receiver_node']]
-
-        node_to_num[x['Caller_node']] = x['Caller']
-        node_to_num[x['Receiver_node']] = x['Receiver']
-        num_to_node[x['Caller']] = x['Caller_node']
-        num_to_node[x['Receiver']] = x['Receiver_node']
-        edges_x,edges_y=addEdge([x0,y0],[x1,y1],[],[], 0.6, 'end', 20, 30, 15)
-        
-        ### 7.3.1. cmap returns the rgba color for the input number in (0.0,1.0)
-        norm_x = x["Duration"]/df["Duration"].max()
-        rgba = cmap(norm_x)
+    node_to_num.update(zip(df['Caller_node'], df['Caller']))
+    node_to_num.update(zip(df['Receiver_node'], df['Receiver']))
+    num_to_node.update(zip(df['Caller'], df['Caller_node']))
+    num_to_node.update(zip(df['Receiver'], df['Receiver_node']))
+
+    node_pos = np.full((max(pos)+1, 2), np.nan)
+    node_pos[list(pos)] = list(pos.values())
+    aggregate = aggregate or merge_directions or len(df) > edge_budget
+    if aggregate:
+        # Level of detail: one edge per pair coloured by the mean duration, only the edge_budget heaviest edges are drawn
+        if edge_table is None:
+            edge_table = EdgeTable(df, merge_directions)
+        kept = edge_table.top(edge_budget)
+        callers, receivers = edge_table.caller[kept], edge_table.receiver[kept]
+        edge_duration = edge_table.mean_duration[kept]
+    else:
+        callers, receivers = df['Caller_node'].values, df['Receiver_node'].values
+        edge_duration = df['Duration'].values
 
+    # Coordinates of every edge (line and arrowhead) in one call, edgeStride points per edge.
+    # Merged edges stand for calls in both directions and get no arrowhead.
+    edges_x, edges_y = addEdges(node_pos[callers], node_pos[receivers], 0.6, None if aggregate and edge_table.merge_directions else 'end', 20, 30, 15)
+    edge_trace = edge_traces(edges_x, edges_y, edge_duration)
 
-        edge_trace.append(dict(type='scatter',
-                               x=edges_x, y=edges_y,
-                               showlegend=False,
-                               line=dict(
-                                   width=3, color='rgba'+str(rgba)),
-                               hoverinfo='none',
-                               mode='lines',
-                               
-        ))  # Graph object for each connection
-       
-    df.apply(add_coords, axis=1)  # Adding edges
+    if aggregate and len(kept):
+        edge_trace.append(edge_hover_trace(node_pos[callers], node_pos[receivers], edge_table, kept))
 
 
 ## 7.4. Adds the caller and reciever node information.
 
     # adding points
+    if node_stats is None:
+        node_stats = NodeStats(df, graph)  # Per node aggregates from stats.py
+    node_trace = nodes_trace(pos, node_stats, selected_callers, selected_receivers)
+
+## 7.5. The main figure for both the edges and nodes data.
+    return network_figure(edge_trace+[node_trace])
+
+### 7.5.1. Edges are bucketed by duration into edge_color_bins colours of cmap, with one WebGL trace per bucket.
+def edge_traces(edges_x, edges_y, edge_duration):
+    edge_trace = [] # Add Edges to Plot
+    edges_x = edges_x.reshape(-1, edgeStride)
+    edges_y = edges_y.reshape(-1, edgeStride)
+    norm_x = edge_duration/edge_duration.max(initial=1)
+    buckets = np.minimum((norm_x*edge_color_bins).astype(int), edge_color_bins-1)
+    for bucket in np.unique(buckets):
+        rows = buckets == bucket
+        edge_trace.append(go.Scattergl(
+                               x=edges_x[rows].ravel(), y=edges_y[rows].ravel(),
+                               showlegend=False,
+                               line=dict(
+                                   width=3, color=matplotlib.colors.to_hex(cmap((bucket+0.5)/edge_color_bins))),
+                               hoverinfo='none',
+                               mode='lines',
+        ))  # Graph object for all the connections of this colour
+    return edge_trace
+
+### 7.5.2. Hover text of the kept edges of an EdgeTable, on invisible markers at the middle of the edges.
+def edge_hover_trace(start, end, edge_table, kept):
+    middle = (start + end)/2
+    first = pd.Series(pd.to_datetime(edge_table.first[kept], unit='s').strftime(date_format + ' ' + time_format))
+    last = pd.Series(pd.to_datetime(edge_table.last[kept], unit='s').strftime(date_format + ' ' + time_format))
+    edge_hover = ('Calls: ' + pd.Series(edge_table.count[kept]).astype(str) +
+                  '<br>Total duration: ' + pd.Series(edge_table.total_duration[kept]).astype(int).astype(str) +
+                  '<br>Mean duration: ' + pd.Series(edge_table.mean_duration[kept]).round(1).astype(str) +
+                  '<br>First: ' + first + '<br>Last: ' + last)
+    return go.Scattergl(
+                           x=middle[:, 0], y=middle[:, 1],
+                           showlegend=False,
+                           mode='markers',
+                           marker=dict(size=8, opacity=0),
+                           hovertext=edge_hover.tolist(),
+                           hoverinfo='text',
+    )
+
+### 7.5.3. Trace of the phone number nodes at pos, sized by their total call duration.
+def nodes_trace(pos, node_stats, selected_callers, selected_receivers):
+    symbols = []
     node_x = []
     node_y = []
-    total_duration = []
     hover_list = []
     for node in pos:
         x, y = pos[node]
         coords_to_node[(x, y)] = node
-        hover_list.append(str(node_to_num[node]))
+        hover_list.append(str(node_to_num[node]) + '<br>Calls: ' + str(node_stats.calls[node]) +
+                          ' (out ' + str(node_stats.out_calls[node]) + ', in ' + str(node_stats.in_calls[node]) + ')')
         node_x.append(x)
         node_y.append(y)
         if node_to_num[node] in selected_callers:
@@ -347,8 +477,8 @@ def plot_network(df, srs, scs):
             symbols.append('diamond-cross')
         else:
             symbols.append('circle')
-        total_duration.append(27*pow((df[(df['Caller_node']==node)|(df['Receiver_node']==node)]['Duration'].sum())/df['Duration'].max(),0.3))
-    node_trace = go.Scatter(
+    total_duration = 27*np.power(node_stats.total_duration[list(pos)]/node_stats.max_duration,0.3)
+    return go.Scattergl(
         x=node_x, y=node_y,
         mode='markers',
         hovertext = hover_list,
@@ -363,8 +493,9 @@ def plot_network(df, srs, scs):
             color='rgb(29,215,126)',
             line_color='black'))  # Nodes visual design info.
 
-## 7.5. The main figure for both the edges and nodes data.
-    fig = go.Figure(data=edge_trace+[node_trace],
+### 7.5.4. Figure of the network plot from its traces.
+def network_figure(data):
+    fig = go.Figure(data=data,
                     layout=go.Layout(
                    
                     titlefont_size=16,
@@ -392,6 +523,82 @@ def plot_network(df, srs, scs):
     fig.update_layout(height=500,width=800,plot_bgcolor='rgb(244, 246, 255)')
     return fig
 
+## 7.6. Community level of the network plot.
+# Every community of the dataset (communities.py) is drawn as one node at its place in the layout of the
+# community graph, and calls between communities as weighted edges. The expanded community is drawn
+# with its own phone numbers, laid out around the place of the community, so a layout is only ever
+# computed for the nodes of one community.
+def plot_communities(data, df, srs, scs, expanded=None, node_stats=None):
+    df=df[df['Receiver_node']!=-1]
+    selected_receivers = [int(p) for p in srs] if srs != 'None' else []
+    selected_callers = [int(p) for p in scs] if scs != 'None' else []
+    communities, full = dataset_communities(data)
+    if node_stats is None:
+        node_stats = NodeStats(df)
+    node_to_num.update(zip(df['Caller_node'], df['Caller']))
+    node_to_num.update(zip(df['Receiver_node'], df['Receiver']))
+    num_to_node.update(zip(df['Caller'], df['Caller_node']))
+    num_to_node.update(zip(df['Receiver'], df['Receiver_node']))
+
+    # Vertex of every node: its community, or count + node for the nodes of the expanded community
+    vertex = communities.labels.copy()
+    members = communities.members_of(expanded) if expanded is not None and 0 <= expanded < communities.count else np.zeros(0, dtype=np.int64)
+    vertex[members] = communities.count + members
+    vertex_pos = np.full((communities.count + len(vertex), 2), np.nan)
+    vertex_pos[:communities.count] = communities.positions(full) * community_spread * np.sqrt(communities.count)
+
+    pos = {}
+    if len(members):
+        shown = members[np.isin(members, np.union1d(df['Caller_node'].values, df['Receiver_node'].values))]
+        inner = df[np.isin(df['Caller_node'].values, shown) & np.isin(df['Receiver_node'].values, shown)]
+        G = nx.Graph()
+        G.add_nodes_from(shown.tolist())
+        G.add_edges_from(zip(inner['Caller_node'].tolist(), inner['Receiver_node'].tolist()))
+        layout = nx.spring_layout(G, seed=0, center=vertex_pos[expanded], scale=community_spread * np.sqrt(len(shown)))
+        pos = {node: tuple(layout[node]) for node in shown.tolist()}
+        vertex_pos[communities.count + shown] = [pos[node] for node in shown.tolist()]
+
+    # Calls between vertices as weighted edges, the calls inside a collapsed community are not drawn
+    vertex_df = pd.DataFrame({'Caller_node': vertex[df['Caller_node'].values], 'Receiver_node': vertex[df['Receiver_node'].values],
+                              'Duration': df['Duration'].values, 'Epoch': df['Epoch'].values})
+    edge_table = EdgeTable(vertex_df)
+    kept = np.flatnonzero(edge_table.caller != edge_table.receiver)
+    kept = kept[np.argsort(edge_table.count[kept], kind='mergesort')[::-1][:edge_budget]]
+    start, end = vertex_pos[edge_table.caller[kept]], vertex_pos[edge_table.receiver[kept]]
+    edges_x, edges_y = addEdges(start, end, 0.6, 'end', 20, 30, 15)
+    data = edge_traces(edges_x, edges_y, edge_table.mean_duration[kept])
+    if len(kept):
+        data.append(edge_hover_trace(start, end, edge_table, kept))
+
+    # Collapsed communities with calls in the filtered data, sized by the total duration of their calls
+    labels = np.unique(vertex[np.union1d(df['Caller_node'].values, df['Receiver_node'].values)])
+    labels = labels[labels < communities.count]
+    coords_to_community.clear()
+    if len(labels):
+        known = np.flatnonzero(communities.labels[:len(node_stats.total_duration)] >= 0)
+        totals = np.bincount(communities.labels[known], weights=node_stats.total_duration[known], minlength=communities.count)
+        hover_list = []
+        for label in labels.tolist():
+            x, y = vertex_pos[label]
+            coords_to_community[(x, y)] = label
+            hover_list.append('Community ' + str(label) + '<br>Members: ' + str(communities.size[label]) +
+                              '<br>Total duration: ' + str(int(totals[label])) + '<br>Click to expand')
+        data.append(go.Scattergl(
+            x=vertex_pos[labels, 0], y=vertex_pos[labels, 1],
+            mode='markers',
+            hovertext=hover_list,
+            hoverinfo='text',
+            showlegend=False,
+            marker=dict(
+                size=12 + 40*np.power(totals[labels]/max(totals.max(), 1), 0.3),
+                symbol='circle',
+                line_width=2,
+                color='rgb(99,110,250)',
+                line_color='black')))
+    if pos:
+        data.append(nodes_trace(pos, node_stats, selected_callers, selected_receivers))
+    return network_figure(data)
+
 # store layout (after app.layout) in file and try to import that
 
 
@@ -409,76 +616,56 @@ app.layout = dash_layout2
 
 sel_lat = 0
 sel_lon = 0
+## 9.0. DETECTORS OF THE ML MODES, fitted on the feature matrix built by preprocess_data (see features.py).
+ml_detectors = {3: 'IsolationForest', 4: 'EllipticEnvelope', 5: 'LocalOutlierFactor'}
+
 ## 9.1. TO UPDATE THE DataFrame BASED ON ALL FILTER VALUES.
 @app.callback(
     [Output(component_id='filtered-data', component_property='children'),
-     Output(component_id='message', component_property='children')],
-    [Input('radius-slider', 'value'),Input('upload-data', 'contents'),Input(component_id='date-picker1', component_property='date'),Input(component_id='date-picker2', component_property='date'), Input(component_id='duration-slider', component_property='value'), Input(component_id='time-slider', component_property='value'),
-     Input(component_id='select-caller-receiver', component_property='value'), Input(component_id='caller-dropdown', component_property='value'), Input(component_id='receiver-dropdown', component_property='value'),Input(component_id='ml-mode', component_property='value'),Input(component_id='contamination-slider', component_property='value')]
+     Output(component_id='message', component_property='children'),
+     Output(component_id='ml-interval', component_property='disabled')],
+    [Input('radius-slider', 'value'),Input('dataset-version', 'children'),Input(component_id='date-picker1', component_property='date'),Input(component_id='date-picker2', component_property='date'), Input(component_id='duration-slider', component_property='value'), Input(component_id='time-slider', component_property='value'),
+     Input(component_id='select-caller-receiver', component_property='value'), Input(component_id='caller-dropdown', component_property='value'), Input(component_id='receiver-dropdown', component_property='value'),Input(component_id='ml-mode', component_property='value'),Input(component_id='contamination-slider', component_property='value'),
+     Input(component_id='ml-interval', component_property='n_intervals')]
 )
-def update_filtered_div_caller(radius,contents, selected_date1, selected_date2, selected_duration, selected_time, selected_option, selected_caller, selected_receiver,ml_value,contamination):
+def update_filtered_div_caller(radius,version, selected_date1, selected_date2, selected_duration, selected_time, selected_option, selected_caller, selected_receiver,ml_value,contamination,ml_intervals):
     # Date,Time,Duration Filter
-    global suspicious_users
-    if contents is not None:
-        content_type, content_string = contents.split(',')
-        decoded = base64.b64decode(content_string)
-        global df
-        df = pd.read_csv(io.StringIO(decoded.decode('utf-8')))
-        preprocess_data(df)
-
-    filtered_df = df[(df['Date'] >= pd.to_datetime(selected_date1)) & (df['Date'] <= pd.to_datetime(selected_date2))
-                     & ((df['Duration'] >= selected_duration[0]) & (df['Duration'] <= selected_duration[1]))
-                     & ((df['Time'] < times[selected_time[1]]['label']) & (df['Time'] >= times[selected_time[0]]['label']))].reset_index(drop=True)
-    def chk(lat1,lon1,radius):
-        R = 6373.0
-        global sel_lat
-        global sel_lon
-        lat2 = sel_lat
-        lon2 = sel_lon
-
-        dlon = lon2 - lon1
-        dlat = lat2 - lat1
-
-        a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
-        c = 2 * atan2(sqrt(a), sqrt(1 - a))
-
-        distance = R * c
-        print(distance)
-        if distance > radius:
-            return False
-        return True
-
+    data = sync_dataset()
+    df = data.df
+
+    # Date range by binary search on the sorted Epoch, then integer masks for duration and time of day
+    window = date_slice(df, selected_date1, selected_date2)
+    seconds = window['Time_sec'].values
+    duration = window['Duration'].values
+    mask = ((duration >= selected_duration[0]) & (duration <= selected_duration[1])
+            & (seconds >= selected_time[0]*time_slot) & (seconds < selected_time[1]*time_slot))
+    filtered_df = window[mask].reset_index(drop=True)
     if radius != 0:
-        towers_c = towers.copy()
-        ver = towers_c.apply(lambda x: chk(x['lat'],x['lon'],radius), axis=1)
-        towers_req = towers_c[ver]['TowerID'].unique()
+        # Towers within the radius of the point clicked on the map, from the spatial index
+        towers_req = tower_index.within(sel_lat, sel_lon, radius)
         filtered_df = filtered_df[filtered_df['TowerID'].isin(towers_req)]
 
     
     if ml_value in [1,2,3,4,5,6]:
-        filtered_df=pd.merge(filtered_df,towers[['lat','lon','TowerID','Suspicious']],on='TowerID')
-        filtered_df['Time_new']=pd.to_datetime(filtered_df['Time'],format='%H:%M:%S')
-        filtered_df["Time_new"]=filtered_df["Time_new"].apply(lambda x: (x - x.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds())
-        filtered_df["Suspicious users"]=filtered_df[["Caller","Receiver"]].apply(lambda x : 1 if (x.Caller in suspicious_users or x.Receiver in suspicious_users) else 0,axis=1)
+        # Rows of the precomputed feature matrix, records of towers without a location are left out
+        filtered_df=filtered_df[filtered_df['Tower_code'].values>=0]
+        rows=filtered_df['Row_id'].values
         contamination/=100
-        if (ml_value==3):
-            iso=IsolationForest(contamination=contamination)
-            mask=iso.fit_predict(filtered_df[["Time_new","Duration","lat","lon",'Suspicious','Suspicious users']])==-1
-            filtered_df=filtered_df[mask].drop(['lat','lon','Time_new'],axis=1)
-        elif(ml_value==4):
-            iso=EllipticEnvelope(contamination=contamination)
-            mask=iso.fit_predict(filtered_df[["Time_new","Duration","lat","lon",'Suspicious','Suspicious users']])==-1
-            filtered_df=filtered_df[mask].drop(['lat','lon','Time_new'],axis=1)
-        elif(ml_value==5):
-            iso=LocalOutlierFactor(contamination=contamination)
-            mask=iso.fit_predict(filtered_df[["Time_new","Duration","lat","lon",'Suspicious','Suspicious users']])==-1
-            filtered_df=filtered_df[mask].drop(['lat','lon','Time_new'],axis=1)
+        if ml_value in ml_detectors:
+            # Scores of the detector fitted once on the whole dataset (in the background), the contamination only sets the threshold
+            try:
+                scores = scoring_pool.scores(data.ml_key, ml_detectors[ml_value], data.ml_feature_key, data.ml_X, rows)
+            except FitError as error:
+                # The fit failed in the pool, it is reported and not retried: the ml-interval stops
+                return dash.no_update, str(error), True
+            if scores is None:
+                # Still fitting in the pool, the ml-interval calls back until the scores are ready
+                return dash.no_update, 'Fitting the anomaly detector...', False
+            filtered_df=filtered_df[outliers(scores, contamination)]
         elif(ml_value==1):
-            filtered_df=filtered_df[filtered_df["Suspicious"]==1]
-            filtered_df=filtered_df.drop(['lat','lon','Time_new'],axis=1)
+            filtered_df=filtered_df[data.ml_X[rows, feature_columns.index('Suspicious')]==1]
         elif(ml_value==2):
-            filtered_df=filtered_df[filtered_df["Suspicious users"]==1]
-            filtered_df=filtered_df.drop(['lat','lon','Time_new'],axis=1)
+            filtered_df=filtered_df[data.ml_X[rows, feature_columns.index('Suspicious users')]==1]
     # Number Filter
     # If Caller is Selected
     if(selected_option == 1):
@@ -506,10 +693,49 @@ def update_filtered_div_caller(radius,contents, selected_date1, selected_date2,
 
     if filtered_df.shape[0] == 0:
         # No update since nothing matches
-        return dash.no_update, 'Nothing Matches that Query'
+        return dash.no_update, 'Nothing Matches that Query', True
     else:
-        # Update Filtered Dataframe
-        return filtered_df.to_json(date_format='iso', orient='split'), 'Updated'
+        # Update Filtered Dataframe. Only the token of the stored frame goes to the browser.
+        return store.put(filtered_df, data.tag), 'Updated', True
+
+## 9.1.1. Returns the filtered dataframe stored under the token in the 'filtered-data' div.
+# data is the dataset taken from sync_dataset, frames filtered from another dataset are not returned.
+def load_filtered(token, data):
+    filtered_df = store.get(token, data.tag)
+    if filtered_df is None:
+        # Frame was evicted from the store, filtered from a previous upload (9.1. refilters it once
+        # the new version reaches the browser) or nothing filtered yet: wait for the next filter update.
+        raise PreventUpdate
+    return filtered_df
+
+## 9.1.2. TO INGEST AN UPLOAD IN THE BACKGROUND AND REPORT ITS PROGRESS.
+# The upload is parsed by a thread of this worker (ingest.py) and published as a new dataset
+# version in the store directory; progress is read from there too, so any worker can answer the polls.
+@app.callback(
+    Output('upload-key', 'children'),
+    [Input('upload-data', 'contents')]
+)
+def start_upload(contents):
+    if contents is None:
+        raise PreventUpdate
+    key = upload_key(contents)
+    uploads.start(key, contents)
+    return key
+
+@app.callback(
+    [Output('output-data-upload', 'children'), Output('upload-interval', 'disabled'), Output('dataset-version', 'children')],
+    [Input('upload-key', 'children'), Input('upload-interval', 'n_intervals')]
+)
+def show_upload_progress(key, n_intervals):
+    if key is None:
+        return '', True, dash.no_update
+    progress = uploads.progress(key) or {'fraction': 0.0, 'rows': 0}
+    if progress.get('error'):
+        return 'Upload failed: ' + progress['error'], True, dash.no_update
+    if progress.get('done'):
+        # The new version triggers 9.1., which reloads the dataset and filters it again
+        return 'Uploaded {} rows'.format(progress['rows']), True, progress['version']
+    return 'Uploading... {:.0%} ({} rows)'.format(progress['fraction'], progress['rows']), False, dash.no_update
 
 @app.callback(
     Output(component_id='stat-anom',component_property='style'),
@@ -521,76 +747,49 @@ def hide_stat(mode):
     else:
         return {'display':'none'}
 
-@app.callback(
-    Output('Duration-distribution-plot', 'figure'),
-    [Input('Anomaly-from-dropdown', 'value'), Input(component_id='filtered-data', component_property='children')]
-    )
-def Update_Duration_distrib(feature_value, filtered_data):
-
-    if feature_value == 1:	
-        #Anomaly from Duration - CDR
-        df = pd.read_json(filtered_data, orient='split')
-        df_cdr = df[df["Receiver"]!=20000]
-        EachNumTotDur = SumFeatures(df=df_cdr, pivot_identifier=['Caller', 'Receiver'], SD_dict={"Duration":None}) #SD_dict's keys aren't used in the function
-        hist_data = [EachNumTotDur["Duration"]]
-        group_labels = ['Duration Distribution of the filtered data - CDR'] # name of the dataset
-        fig = ff.create_distplot(hist_data, group_labels,  show_hist=False)
-        fig.update_layout(margin=dict(l = 0, r = 0, t = 0, b = 0))
-        return fig
-
+## Per entity sums for the statistical anomaly mode, dropdown value -> (table, feature) of the AnomalyEngine
+anomaly_features = {1: ('cdr', 'Duration'), 2: ('ipdr', 'Duration'), 3: ('ipdr', 'Uplink Volume'),
+                    4: ('ipdr', 'Downlink Volume'), 5: ('ipdr', 'Total Volume')}
+anomaly_labels = {1: 'Duration Distribution of the filtered data - CDR', 2: 'Duration Distribution of the filtered data - IPDR',
+                  3: 'Uplink Volume Distribution of the filtered data', 4: 'Downlink Volume Distribution of the filtered data',
+                  5: 'Total Volume Distribution of the filtered data'}
 
-    elif feature_value == 2:	
-        #Anomaly from Duration - IPDR
-        df = pd.read_json(filtered_data, orient='split')
-        df_ipdr = df[df["Receiver"]==20000]
-        EachNumTotDur = SumFeatures(df=df_ipdr, pivot_identifier=['Caller'], SD_dict={"Duration":None}) #SD_dict's keys aren't used in the function
-        hist_data = [EachNumTotDur["Duration"]]
-        group_labels = ['Duration Distribution of the filtered data - IPDR'] # name of the dataset
-        fig = ff.create_distplot(hist_data, group_labels, show_hist=False)
-        fig.update_layout(margin=dict(l = 0, r = 0, t = 0, b = 0))
-        return fig
-
-
-    elif feature_value == 3:	
-        #Anomaly from Uplink Volume - IPDR
-        df = pd.read_json(filtered_data, orient='split')
-        df_ipdr = df[df["Receiver"]==20000]
-        EachNumTotDur = SumFeatures(df=df_ipdr, pivot_identifier=['Caller'], SD_dict={"Uplink Volume":None}) #SD_dict's keys aren't used in the function
-        hist_data = [EachNumTotDur["Uplink Volume"]]
-        group_labels = ['Uplink Volume Distribution of the filtered data'] # name of the dataset
-        fig = ff.create_distplot(hist_data, group_labels,  show_hist=False)
-        fig.update_layout(margin=dict(l = 0, r = 0, t = 0, b = 0))
-        return fig
+def anomaly_engine(df):
+    return AnomalyEngine({'cdr': (df[df["Receiver"]!=20000], ['Caller', 'Receiver'], ['Duration']),
+                          'ipdr': (df[df["Receiver"]==20000], ['Caller'], ['Duration', 'Uplink Volume', 'Downlink Volume', 'Total Volume'])})
 
-
-    elif feature_value == 4:	
-        #Anomaly from Downlink Volume - IPDR
-        df = pd.read_json(filtered_data, orient='split')
-        df_ipdr = df[df["Receiver"]==20000]
-        EachNumTotDur = SumFeatures(df=df_ipdr, pivot_identifier=['Caller'], SD_dict={"Downlink Volume":None}) #SD_dict's keys aren't used in the function
-        hist_data = [EachNumTotDur["Downlink Volume"]]
-        group_labels = ['Downlink Volume Distribution of the filtered data'] # name of the dataset
-        fig = ff.create_distplot(hist_data, group_labels,  show_hist=False)
-        fig.update_layout(margin=dict(l = 0, r = 0, t = 0, b = 0))
-        return fig
-
-
-    elif feature_value == 5:	
-        #Anomaly from Total Volume - IPDR
-        df = pd.read_json(filtered_data, orient='split')
-        df_ipdr = df[df["Receiver"]==20000]
-        EachNumTotDur = SumFeatures(df=df_ipdr, pivot_identifier=['Caller'], SD_dict={"Total Volume":None}) #SD_dict's keys aren't used in the function
-        hist_data = [EachNumTotDur["Total Volume"]]
-        group_labels = ['Total Volume Distribution of the filtered data'] # name of the dataset
-        fig = ff.create_distplot(hist_data, group_labels,  show_hist=False)
+@app.callback(
+    [Output('Duration-distribution-plot', 'figure'), Output('stat-anom-flagged', 'children')],
+    [Input('Anomaly-from-dropdown', 'value'), Input(component_id='filtered-data', component_property='children'),
+     Input('alpha-slider', 'value'), Input('estimator-dropdown', 'value')]
+    )
+def Update_Duration_distrib(feature_value, filtered_data, alpha, method):
+
+    if feature_value not in anomaly_features:
+        return go.Figure(), ''
+    # The sums and the distribution plot are computed once per filtered dataset, moving the slider only rescores.
+    data = sync_dataset()
+    engine = store.derived(filtered_data, data.tag, 'anomaly_engine', anomaly_engine)
+    if engine is None:
+        raise PreventUpdate
+    name, feature = anomaly_features[feature_value]
+    hist_data = [engine.sums[(name, feature)]]
+    if len(hist_data[0]) < 2:
+        return go.Figure(), 'Not enough records'
+
+    def distplot(df):
+        fig = ff.create_distplot(hist_data, [anomaly_labels[feature_value]], show_hist=False)
         fig.update_layout(margin=dict(l = 0, r = 0, t = 0, b = 0))
-        return fig
-
-    return go.Figure()
-
-
-################# TODO : ADD THE ALPHA SLIDER WHICH WILL DENOTE THE STANDARD DEVIATION LIMIT, AND THEN FLAG THOSE RECORDS WHO ARE ABOVE THE CALCULATED THRESHOLD. - Animesh.
+        return fig.to_dict()
 
+    fig = go.Figure(store.derived(filtered_data, data.tag, 'distplot-' + str(feature_value), distplot))
+    flagged, threshold = engine.anomalies(name, feature, alpha, method)
+    fig.add_shape(type='line', x0=threshold, x1=threshold, xref='x', y0=0, y1=1, yref='paper', line=dict(color='red', dash='dash'))
+    s = 'Threshold: ' + str(round(threshold, 3)) + '\n'
+    s += 'Flagged: ' + str(len(flagged)) + '\n'
+    for number, total in flagged.items():
+        s += '\t' + str(number) + ' : ' + str(round(total, 3)) + '\n'
+    return fig, s
 
 
 ## 9.2. TO UPDATE THE HOVER DATA OF THE SELECTED NODE.
@@ -599,8 +798,10 @@ def Update_Duration_distrib(feature_value, filtered_data):
     [Input('network-plot', 'hoverData'), Input(component_id='filtered-data', component_property='children'),Input(component_id='map-plot',component_property='hoverData')])
 def display_hover_data(hoverData, filtered_data,hoverDataMap):
 
-    df = pd.read_json(filtered_data, orient='split')
-    if hoverData is not None and 'marker.size' in hoverData['points'][0]:
+    data = sync_dataset()
+    df = load_filtered(filtered_data, data)
+    if hoverData is not None and 'marker.size' in hoverData['points'][0] and (
+            hoverData['points'][0]['x'], hoverData['points'][0]['y']) in coords_to_node:  # Not a community (see 7.6.)
         # Get node number corresponding to the point.
         nodeNumber = coords_to_node[(
             hoverData['points'][0]['x'], hoverData['points'][0]['y'])]
@@ -608,25 +809,32 @@ def display_hover_data(hoverData, filtered_data,hoverDataMap):
             str(node_to_num[nodeNumber]) + '\n'  # hd: Hover Data string
 
         # Functions are from stats.py
-        hd += "Mean Duration : " + str(meanDur(nodeNumber, df)) + "\n"
+        graph = store.derived(filtered_data, data.tag, 'call_graph', CallGraph)
+        node_stats = store.derived(filtered_data, data.tag, 'node_stats', lambda d: NodeStats(d, graph))  # Degrees from the cached graph
+        hd += "Mean Duration : " + str(meanDur(nodeNumber, node_stats)) + "\n"
         hd += "Peak Hours(duration):\n"
-        m = peakHours(nodeNumber, df)
+        m = peakHours(nodeNumber, store.derived(filtered_data, data.tag, 'talk_time', talkTime))  # Hourly table of all nodes
         for x in m:
             hd += "\t\t  " + str(x)+"-"+str(x+1)+" : "+str(m[x])+"\n"
-        z = ogIc(nodeNumber, df)  # Outgoing Incoming
+        z = ogIc(nodeNumber, node_stats)  # Outgoing Incoming
         hd += "No. of Outgoing Calls: " + str(z[0])+"\n"
         hd += "No. of Incomming Calls: " + str(z[1])+"\n"
-        z = mostCalls(nodeNumber, df)  # Most Calls
+        contacts = store.derived(filtered_data, data.tag, 'contacts', lambda d: Contacts(graph))  # Pair aggregates, once per filtered dataset
+        z = mostCalls(nodeNumber, contacts)  # Most Calls
         hd += "Most Calls to: " + str(z[0]) + "\n"
         hd += "Most Calls from: " + str(z[1]) + "\n"
         hd += "Most Calls: " + str(z[2]) + "\n"
+        if nodeNumber < len(graph):
+            hd += "Top Contacts (calls, duration):\n"
+            for number, calls, duration in contacts.top(nodeNumber, 3):
+                hd += "\t\t  " + str(number) + " : " + str(calls) + ", " + str(duration) + "\n"
         return hd
         
         
     if hoverDataMap is not None:
     
         cur_lat,cur_lon=hoverDataMap['points'][0]['lat'],hoverDataMap['points'][0]['lon']
-        add_string = towers_add[(towers_add['lat']==cur_lat) & (towers_add['lon']==cur_lon)]['Address']
+        add_string = tower_address.get(tower_index.nearest(cur_lat, cur_lon), '')
         return add_string
     return "Hover data..."
 
@@ -655,8 +863,9 @@ def display_click_data(clickData,filtered_data):
     margin= dict(l = 0, r = 0, t = 0, b = 0),
     height=200,
 )
-    df = pd.read_json(filtered_data, orient='split')
-    if clickData is not None and 'marker.size' in clickData['points'][0]:
+    df = load_filtered(filtered_data, sync_dataset())
+    if clickData is not None and 'marker.size' in clickData['points'][0] and (
+            clickData['points'][0]['x'], clickData['points'][0]['y']) in coords_to_node:  # Not a community (see 7.6.)
         nodeNumber = coords_to_node[(
             clickData['points'][0]['x'], clickData['points'][0]['y'])]
         groups=df[df['IMEI_node']==nodeNumber].groupby('App_name')['Caller'].count()
@@ -689,8 +898,8 @@ def display_click_data(clickData,filtered_data):
     )
 def update_ipdr_simult_users(clickData, filtered_data):
     if clickData is not None:
-        df = pd.read_json(filtered_data, orient='split')
-        new_df = df[df['App_name'] == clickData['points'][0]['label']].drop(['Unnamed: 0', 'Dura_color', 'Caller_node', 'Receiver_node'], axis=1)
+        df = load_filtered(filtered_data, sync_dataset())
+        new_df = df[df['App_name'] == clickData['points'][0]['label']].drop(['Unnamed: 0', 'Caller_node', 'Receiver_node', 'Epoch', 'Time_sec', 'Tower_code', 'Row_id'], axis=1, errors='ignore')
         return new_df.to_string(index=False)
     else:
         return [None]    
@@ -718,13 +927,17 @@ l = []
     [Output('selected-data', 'children'),Output('movement-plot','figure')],
     [Input('network-plot', 'selectedData'), Input(component_id='filtered-data', component_property='children')])
 def display_selected_data(selectedData, filtered_data):
-    df = pd.read_json(filtered_data, orient='split')
+    data = sync_dataset()
+    df = load_filtered(filtered_data, data)
     # TODO #3 Graph should also be filtered and only nodes in component should be displayed
     if selectedData is not None:
         global l
         for point in selectedData['points']:
+            if (point['x'], point['y']) in coords_to_node:  # Nodes only, not the edge hover markers
                 l.append(node_to_num[coords_to_node[point['x'], point['y']]])
-        components = bfs(l, df[df['Receiver']!=20000])
+        # Components are labelled once per filtered dataset, then looked up for the selected numbers
+        graph = store.derived(filtered_data, data.tag, 'call_graph', CallGraph)
+        components = bfs(l, df[df['Receiver']!=20000], graph, store.derived(filtered_data, data.tag, 'components', lambda d: Components(graph)))
         s = ""
         i = 1
         for component in components:
@@ -776,9 +989,10 @@ def update_caller_value(n_clicks):
 ## 9.7. TO UPDATE THE MAIN PLOT w.r.t. SELECTED RECEIVERS & CALLERS. 
 @app.callback(
     Output(component_id='network-plot', component_property='figure'),
-    [Input(component_id='collapse-filters', component_property='n_clicks'),Input(component_id='filtered-data', component_property='children'), Input(component_id='receiver-dropdown', component_property='value'), Input(component_id='caller-dropdown', component_property='value')]
+    [Input(component_id='collapse-filters', component_property='n_clicks'),Input(component_id='filtered-data', component_property='children'), Input(component_id='receiver-dropdown', component_property='value'), Input(component_id='caller-dropdown', component_property='value'),
+     Input(component_id='network-lod', component_property='value'), Input(component_id='expanded-community', component_property='children')]
 )
-def update_network_plot_caller(n_clicks,filtered_data, srs, scs):
+def update_network_plot_caller(n_clicks,filtered_data, srs, scs, lod, expanded):
     # if zoom == True and fig['layout']['height'] != 850:
     #     fig['layout']['height']=850
     #     fig['layout']['width']=850
@@ -787,7 +1001,23 @@ def update_network_plot_caller(n_clicks,filtered_data, srs, scs):
     #     fig['layout']['height']=500
     #     fig['layout']['width']=500
     #     return fig
-    fig = plot_network(pd.read_json(filtered_data, orient='split'), srs, scs)
+    data = sync_dataset()
+    df = load_filtered(filtered_data, data)
+    graph = store.derived(filtered_data, data.tag, 'call_graph', CallGraph)
+    node_stats = store.derived(filtered_data, data.tag, 'node_stats', lambda d: NodeStats(d, graph))  # Degrees from the cached graph
+    if 'communities' in (lod or []) or (node_stats.calls > 0).sum() > community_view_nodes:
+        # Community level, opened on large graphs, with the community clicked last expanded
+        fig = plot_communities(data, df, srs, scs, int(expanded) if expanded else None, node_stats)
+        if n_clicks!= None and n_clicks%2==1:
+            fig.update_layout(height=500)
+        return fig
+    merge_directions = 'merge' in (lod or [])
+    aggregate = 'aggregate' in (lod or []) or merge_directions or (df['Receiver_node'].values != -1).sum() > edge_budget
+    edge_table = None
+    if aggregate:
+        # Weighted edges of the filtered data, built once per filtered dataset and direction mode
+        edge_table = store.derived(filtered_data, data.tag, 'edge_table' + ('_merged' if merge_directions else ''), lambda d: EdgeTable(d, merge_directions))
+    fig = plot_network(data, df, srs, scs, node_stats, graph, aggregate, merge_directions, edge_table)
     if n_clicks!= None and n_clicks%2==1:
         fig.update_layout(height=500)
     
@@ -795,21 +1025,43 @@ def update_network_plot_caller(n_clicks,filtered_data, srs, scs):
 
 
 
+## 9.7.1. TO EXPAND THE COMMUNITY CLICKED IN THE COMMUNITY LEVEL OF THE NETWORK PLOT.
+@app.callback(
+    Output(component_id='expanded-community', component_property='children'),
+    [Input('network-plot', 'clickData'), Input(component_id='network-lod', component_property='value')]
+)
+def expand_community(clickData, lod):
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    if 'network-lod.value' in triggered:
+        return ''   # Back to all communities collapsed
+    if clickData is None:
+        raise PreventUpdate
+    point = clickData['points'][0]
+    if (point['x'], point['y']) not in coords_to_community:
+        raise PreventUpdate    # A phone number or an edge, handled by 9.3.
+    return str(coords_to_community[(point['x'], point['y'])])
+
+
+
 ## 9.7. TO UPDATE THE MAIN PLOT AFTER FILTERING THE DATA FROM 9.1.
 # Callback to update map plot
 @app.callback(
     Output(component_id='map-plot',component_property='figure'),
-    [Input(component_id='filtered-data', component_property='children')]
+    [Input(component_id='filtered-data', component_property='children'), Input(component_id='map-mode', component_property='value')]
 
 )
-def update_map_plot_callback(filtered_data):
-    return plot_map(pd.read_json(filtered_data, orient='split'))
+def update_map_plot_callback(filtered_data, map_mode):
+    data = sync_dataset()
+    if map_mode in density_metrics:
+        # Aggregated per geohash cell on the server, the figure size depends on the number of cells only
+        return plot_density(load_filtered(filtered_data, data), map_mode)
+    return plot_map(load_filtered(filtered_data, data), data)
 
 
 
 ## 9.8. TO TOGGLE BETWEEN MAP OR NETWORK PLOT
 @app.callback(
-    [Output(component_id='network-view',component_property='style'),Output(component_id='map-plot',component_property='style')],
+    [Output(component_id='network-view',component_property='style'),Output(component_id='map-view',component_property='style')],
     [Input(component_id='toggle-network-map',component_property='value')]
 )
 def toggle_network_map(toggle):
@@ -843,7 +1095,7 @@ def toggle_cdr_ipdr(toggle):
     [Input(component_id='date-picker1', component_property='date'),Input(component_id='date-picker2', component_property='date')]
 )
 def update_phone_div_caller(selected_date1, selected_date2):
-    return [{'label': 'None', 'value': ''}]+[{'label': k, 'value': k} for k in df[(df['Date'] >= pd.to_datetime(selected_date1)) & (df['Date']<=pd.to_datetime(selected_date2))]['Caller'].unique()]
+    return [{'label': 'None', 'value': ''}]+[{'label': k, 'value': k} for k in date_slice(sync_dataset().df, selected_date1, selected_date2)['Caller'].unique()]
 
 
 
@@ -853,7 +1105,7 @@ def update_phone_div_caller(selected_date1, selected_date2):
     [Input(component_id='date-picker1', component_property='date'),Input(component_id='date-picker2', component_property='date')]
 )
 def update_phone_div_receiver1(selected_date1, selected_date2):
-    return [{'label': 'None', 'value': ''}]+[{'label': k, 'value': k} for k in df[(df['Date'] >= pd.to_datetime(selected_date1)) & (df['Date']<=pd.to_datetime(selected_date2))]['Receiver'].unique()]
+    return [{'label': 'None', 'value': ''}]+[{'label': k, 'value': k} for k in date_slice(sync_dataset().df, selected_date1, selected_date2)['Receiver'].unique()]
 
 
 
@@ -927,7 +1179,7 @@ def login(n_clicks1, n_clicks2, username, password):
     [Input('filtered-data','children')]
 )
 def print_filtered(filtered_data):
-    df_new =pd.read_json(filtered_data, orient='split').reset_index(drop=True)[['Caller','Receiver','Date','Time','Duration','IMEI']]
+    df_new =load_filtered(filtered_data, sync_dataset()).reset_index(drop=True)[['Caller','Receiver','Date','Time','Duration','IMEI']]
     return dash_table.DataTable(id='table',columns=[{"name": i, "id": i} for i in df_new.columns],data=df_new.to_dict('records'), filter_action="native",
         sort_action="native",sort_mode="multi", column_selectable="single", row_selectable="multi",page_size= 10,)
 
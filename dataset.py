@@ -0,0 +1,110 @@
+import os
+import sys
+
+import pandas as pd
+from pyarrow import feather
+
+from preprocess import app_names, ipdr_receiver
+
+# Typed on-disk format for the CDR/IPDR data.
+# The csv files in ./data are converted once into a compressed Feather (Arrow) file with
+# an explicit schema, which the app then loads at startup without parsing any text:
+#   python dataset.py data/final_data.csv data/final_data.feather
+# Accepts final_data.csv, data.csv (CDR only) and ipdr_data.csv (IPDR only).
+
+date_format = '%d-%m-%Y'
+time_format = '%H:%M:%S'
+
+# Destination port -> app name, used for the App_name column
+ports_to_apps = {'DEST PORT':'App','0':'nan','5223':'WhatsApp','5228':'WhatsApp', '4244':'WhatsApp', '5222':'WhatsApp', '5242':'WhatsApp','443_':'Skype','443':'SSL',\
+    '3478-3481':'Skype','49152-65535':'Skype','80':'Web connection','8080':'Web Connection', \
+        '8081': 'Web Connection', '993':'IMAP', '143':'IMAP', '8024':'iTunes', '8027':'iTunes', '8013':'iTunes', \
+            '8017':'iTunes', '8003':'iTunes', '7275':'iTunes', '8025':'iTunes', '8009':'iTunes',\
+                '58128': 'Xsan', '51637':'Xsan', '61076':'Xsan','40020':'Microsoft Online Games', '40017':'Microsoft Various Games', \
+                    '40023':'Microsoft Online Games',\
+                    '40019':'Microsoft Online Games', '40001':'Microsoft Online Games', '40004':'Microsoft Online Games', \
+                        '40034':'Microsoft Online Games', '40031':'Microsoft Online Games', '40029':'Microsoft Online Games',\
+                              '40005':'Microsoft Online Games', '40026': 'Microsoft Online Games', '40008': 'Microsoft Online Games',\
+                                  '40032':'Microsoft Online Games'}   # did not took '443':'SSL, Web connection' to avoid double 443.
+
+# Column -> dtype of the converted file. Date and Time are stored as the single 'Timestamp' column.
+schema = {
+    'Caller': 'int64',
+    'Receiver': 'int64',
+    'Timestamp': 'datetime64[ns]',
+    'Duration': 'int32',
+    'TowerID': 'category',
+    'IMEI': 'int64',
+    'Private IP': 'str',
+    'Private Port': 'int32',
+    'Public IP': 'str',
+    'Public Port': 'int32',
+    'Dest IP': 'str',
+    'DEST PORT': 'category',
+    'MSISDN': 'int64',
+    'IMSI': 'int64',
+    'Uplink Volume': 'float64',
+    'Downlink Volume': 'float64',
+    'Total Volume': 'float64',
+    'I_RATTYPE': 'category',
+    'App_name': 'category',
+}
+
+# Columns of ipdr_data.csv renamed as in data/final_data_generator.py
+ipdr_columns = {'IMEI': 'Caller', 'Start Date': 'Date', 'Start Time': 'Time', 'CELL_ID': 'TowerID'}
+
+dataset_path = './data/final_data.feather'
+csv_path = './data/final_data.csv'
+
+
+# Casts a raw csv frame (any of the three layouts) to the schema above.
+def apply_schema(raw):
+    raw = raw.drop([c for c in raw.columns if c.startswith('Unnamed')], axis=1)
+    if 'Start Date' in raw.columns:
+        raw = raw.rename(columns=ipdr_columns)
+        raw['Receiver'] = ipdr_receiver
+    for column in schema:
+        if column not in raw.columns and column not in ('Timestamp', 'App_name'):
+            raw[column] = 0     # IPDR columns of CDR only files and vice versa, as in final_data_generator.py
+    df = pd.DataFrame(index=raw.index)
+    for column, dtype in schema.items():
+        if column == 'Timestamp':
+            df[column] = pd.to_datetime(raw['Date'].astype(str) + ' ' + raw['Time'].astype(str),
+                                        format=date_format + ' ' + time_format)
+        elif column == 'App_name':
+            df[column] = app_names(df['DEST PORT'], ports_to_apps).astype('category')
+        elif dtype in ('str', 'category'):
+            df[column] = raw[column].fillna(0).astype(str).astype('category' if dtype == 'category' else object)
+        else:
+            df[column] = raw[column].fillna(0).astype(dtype)
+    return df.reset_index(drop=True)
+
+
+# Writes a typed frame (as returned by apply_schema) to a Feather file.
+def save_dataset(df, dst, compression='lz4'):
+    feather.write_feather(df, dst, compression=compression)
+
+
+def convert(src, dst, compression='lz4'):
+    df = apply_schema(pd.read_csv(src))
+    save_dataset(df, dst, compression)
+    return df
+
+
+# Loads a converted file, or a csv file through apply_schema.
+def load_dataset(path=None):
+    if path is None:
+        path = dataset_path if os.path.exists(dataset_path) else csv_path
+    if path.endswith('.csv'):
+        return apply_schema(pd.read_csv(path))
+    return feather.read_table(path).to_pandas()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python dataset.py <input.csv> [output.feather]')
+        sys.exit(1)
+    src = sys.argv[1]
+    dst = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(src)[0] + '.feather'
+    df = convert(src, dst)
+    print('Wrote', len(df), 'rows to', dst)
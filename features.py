@@ -0,0 +1,36 @@
+import hashlib
+
+import numpy as np
+
+# Feature matrix of the anomaly detectors (ML modes of dash_script.py, ml.py).
+# It is materialised once per dataset as a contiguous float32 array with one row per
+# row of df, so the ML modes slice the rows they need instead of merging the towers
+# and rebuilding the features on every request.
+
+suspicious_towers=['40478-38009-10112','40478-41081-10962474','40458-2131-13052','40467-1164-10423','40458-3091-20260037','40493-903-38141']
+suspicious_users=[9340552262,8824403719,8803318491,8007977426,8650807946,9074636167]
+
+feature_columns = ['Time_sec', 'Duration', 'lat', 'lon', 'Suspicious', 'Suspicious users']
+
+
+# Returns the feature matrix of df (needs Time_sec, see preprocess.time_columns).
+# lat, lon and Suspicious are NaN for the rows of towers that are not in tower_index.
+def feature_matrix(df, tower_index, suspicious_users=suspicious_users):
+    codes = df['Tower_code'].values if 'Tower_code' in df else tower_index.encode(df['TowerID'])
+    known = codes >= 0
+    users = np.array(sorted(set(suspicious_users)), dtype=np.int64)
+    X = np.empty((len(df), len(feature_columns)), dtype=np.float32)
+    X[:, 0] = df['Time_sec'].values
+    X[:, 1] = df['Duration'].values
+    X[:, 2] = np.where(known, tower_index.lat[codes], np.nan)
+    X[:, 3] = np.where(known, tower_index.lon[codes], np.nan)
+    X[:, 4] = np.where(known, tower_index.suspicious[codes], np.nan)
+    X[:, 5] = np.isin(df['Caller'].values, users) | np.isin(df['Receiver'].values, users)
+    return X
+
+
+# Returns a short hash of the feature matrix, the key of the detectors fitted on it (models.py).
+def feature_hash(X):
+    digest = hashlib.sha1(str(X.shape).encode())
+    digest.update(np.ascontiguousarray(X).tobytes())
+    return digest.hexdigest()[:16]
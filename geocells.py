@@ -0,0 +1,69 @@
+import numpy as np
+
+# Geohash cells of the cell towers for the density mode of the map plot.
+# Every tower is put in its geohash cell once at startup, so the records of a filtered
+# frame are aggregated per cell with two bincounts (records -> towers -> cells) and
+# only the cells go to the browser, whatever the number of records or towers.
+
+base32 = np.array(list('0123456789bcdefghjkmnpqrstuvwxyz'))
+
+
+# Returns the geohash of every point as an integer of 5*precision bits (longitude bit first, as in the geohash string).
+def geohash_codes(lat, lon, precision=6):
+    bits = 5 * precision
+    lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+    lon_q = np.clip(((np.asarray(lon, dtype=float) + 180) / 360 * 2**lon_bits).astype(np.int64), 0, 2**lon_bits - 1)
+    lat_q = np.clip(((np.asarray(lat, dtype=float) + 90) / 180 * 2**lat_bits).astype(np.int64), 0, 2**lat_bits - 1)
+    codes = np.zeros(len(lon_q), dtype=np.int64)
+    for bit in range(bits):
+        # Even bits of the hash are longitude bits, odd ones latitude bits, most significant first
+        if bit % 2 == 0:
+            value = (lon_q >> (lon_bits - 1 - bit // 2)) & 1
+        else:
+            value = (lat_q >> (lat_bits - 1 - bit // 2)) & 1
+        codes = (codes << 1) | value
+    return codes
+
+
+# Returns the (lat, lon) of the centre of every geohash cell.
+def geohash_centres(codes, precision=6):
+    bits = 5 * precision
+    lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+    codes = np.asarray(codes, dtype=np.int64)
+    lon_q = np.zeros(len(codes), dtype=np.int64)
+    lat_q = np.zeros(len(codes), dtype=np.int64)
+    for bit in range(bits):
+        value = (codes >> (bits - 1 - bit)) & 1
+        if bit % 2 == 0:
+            lon_q = (lon_q << 1) | value
+        else:
+            lat_q = (lat_q << 1) | value
+    return (lat_q + 0.5) / 2**lat_bits * 180 - 90, (lon_q + 0.5) / 2**lon_bits * 360 - 180
+
+
+# Returns the geohash strings of the codes.
+def geohash_strings(codes, precision=6):
+    codes = np.asarray(codes, dtype=np.int64)
+    chars = [base32[(codes >> (5 * (precision - 1 - k))) & 31] for k in range(precision)]
+    return [''.join(cell) for cell in zip(*chars)]
+
+
+class TowerCells:
+
+    def __init__(self, tower_index, precision=6):
+        self.precision = precision
+        codes = geohash_codes(tower_index.lat, tower_index.lon, precision)
+        self.codes, self.tower_cell = np.unique(codes, return_inverse=True)    # cell codes, cell of every tower code
+        self.tower_cell = self.tower_cell.ravel()
+        self.lat, self.lon = geohash_centres(self.codes, precision)
+        self.names = geohash_strings(self.codes, precision)
+
+    def __len__(self):
+        return len(self.codes)
+
+    # Returns the sum of the weights (number of records if None) of the records in every cell.
+    # tower_codes are the Tower_code of the records, -1 for towers that are not in the index.
+    def aggregate(self, tower_codes, weights=None):
+        known = tower_codes >= 0
+        per_tower = np.bincount(tower_codes[known], weights=None if weights is None else weights[known], minlength=len(self.tower_cell))
+        return np.bincount(self.tower_cell, weights=per_tower, minlength=len(self))
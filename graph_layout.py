@@ -0,0 +1,80 @@
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import networkx as nx
+import numpy as np
+
+from session_store import default_store_dir, private_dir
+
+# Cached layout for the network plot.
+# The graphviz layout of the whole call graph is computed once per dataset (keyed by
+# dataset_hash) and written next to the session store, so every worker reuses it.
+# Filtered graphs take their node positions from that layout, which keeps them stable
+# between filter changes. Nodes missing from it are placed by a short force directed
+# pass that starts next to their neighbours and keeps all known nodes fixed.
+# Layout files of old datasets are evicted from disk with the stored frames (see SessionStore._evict_disk).
+
+
+class LayoutCache:
+
+    def __init__(self, directory=default_store_dir, max_datasets=4):
+        self.directory = directory
+        self.max_datasets = max_datasets
+        self._layouts = OrderedDict()   # dataset key -> {node: (x, y)}
+        self._lock = threading.Lock()
+        private_dir(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.layout')
+
+    # Returns the global layout of the dataset, computing it with build_graph() the first time.
+    def global_layout(self, key, build_graph):
+        with self._lock:
+            if key in self._layouts:
+                self._layouts.move_to_end(key)
+                return self._layouts[key]
+            try:
+                with open(self._path(key), 'rb') as f:
+                    layout = pickle.load(f)
+                os.utime(self._path(key))   # Mark as recently used for the disk LRU of the session store
+            except (OSError, EOFError, pickle.UnpicklingError):
+                layout = dict(nx.nx_agraph.pygraphviz_layout(build_graph()))
+                tmp_path = self._path(key) + '.' + str(os.getpid()) + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(layout, f, protocol=4)
+                os.replace(tmp_path, self._path(key))
+            self._layouts[key] = layout
+            while len(self._layouts) > self.max_datasets:
+                self._layouts.popitem(last=False)
+            return layout
+
+    # Returns the positions of the nodes of G.
+    def positions(self, key, G, build_graph):
+        layout = self.global_layout(key, build_graph)
+        new_nodes = [node for node in G if node not in layout]
+        if new_nodes:
+            placed = place_nodes(G, layout, new_nodes)
+            with self._lock:
+                layout.update(placed)       # Placed once, then stable like the rest of the layout
+        return {node: layout[node] for node in G}
+
+
+# Places new_nodes of G around the nodes that already have a position in layout.
+def place_nodes(G, layout, new_nodes, iterations=30):
+    known = [node for node in G if node in layout]
+    if not known:
+        return dict(nx.nx_agraph.pygraphviz_layout(G))
+    coords = np.array([layout[node] for node in known])
+    center = coords.mean(axis=0)
+    span = max(np.ptp(coords, axis=0).max(), 1.0)
+    rng = np.random.RandomState(0)
+    pos = {node: layout[node] for node in known}
+    for node in new_nodes:
+        # Warm start next to the placed neighbours (or the centre when there are none)
+        neighbours = [pos[n] for n in nx.all_neighbors(G, node) if n in pos]
+        start = np.mean(neighbours, axis=0) if neighbours else center
+        pos[node] = tuple(start + rng.uniform(-0.05, 0.05, 2) * span)
+    pos = nx.spring_layout(G.to_undirected(), pos=pos, fixed=known, k=span / np.sqrt(len(G)), iterations=iterations)
+    return {node: (float(pos[node][0]), float(pos[node][1])) for node in new_nodes}
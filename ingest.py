@@ -0,0 +1,176 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+from dataset import apply_schema, load_dataset, save_dataset, schema
+from session_store import default_store_dir, private_dir, token_pattern
+
+# Streaming ingestion of an uploaded csv (contents of the dcc.Upload component).
+# The base64 payload is decoded a block at a time and parsed in chunks, every chunk
+# is cast to the typed schema right away, so the decoded text is never held in memory
+# as a whole and peak memory stays around one chunk plus the typed result.
+
+
+# File-like object decoding the base64 part of a 'data:...;base64,' string lazily.
+class Base64Reader(io.RawIOBase):
+
+    def __init__(self, contents, block_size=4 * 2**20):
+        self.contents = contents
+        self.start = contents.index(',') + 1     # Skip the 'data:text/csv;base64,' header
+        self.position = self.start
+        self.block_size = block_size - block_size % 4   # Decode whole base64 quanta only
+        self.pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending and self.position < len(self.contents):
+            end = min(self.position + self.block_size, len(self.contents))
+            self.pending = base64.b64decode(self.contents[self.position:end])
+            self.position = end
+        n = min(len(buffer), len(self.pending))
+        buffer[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+    # Fraction of the upload decoded so far.
+    def progress(self):
+        return (self.position - self.start) / max(len(self.contents) - self.start, 1)
+
+
+# Parses the uploaded contents chunk by chunk and returns the typed frame.
+# progress, if given, is called with (fraction done, rows parsed) after every chunk.
+def ingest_upload(contents, chunksize=100000, progress=None):
+    reader = Base64Reader(contents)
+    text = io.TextIOWrapper(io.BufferedReader(reader), encoding='utf-8')
+    chunks = []
+    rows = 0
+    for chunk in pd.read_csv(text, chunksize=chunksize):
+        chunks.append(apply_schema(chunk))
+        rows += len(chunk)
+        if progress is not None:
+            progress(reader.progress(), rows)
+    df = pd.concat(chunks, ignore_index=True)
+    # Chunks carry their own categories, concat falls back to object for those columns.
+    for column, dtype in schema.items():
+        if dtype == 'category':
+            df[column] = df[column].astype('category')
+    return df
+
+
+# Uploaded datasets shared by all the gunicorn workers.
+# The upload is ingested by a background thread of the worker that received it, so the
+# request returns at once. Progress is written to a small file in the store directory and
+# the typed result to a Feather file named by a new dataset version, then the version
+# becomes the current one. Every worker compares its own version with the current one
+# and reloads the dataset when it has changed, so all workers serve the same data.
+# The current version belongs to one server run: a restarted server ignores it and starts
+# again from the bundled dataset.
+class UploadedDatasets:
+
+    def __init__(self, run, directory=default_store_dir, keep=2, progress_age=3600):
+        self.run = str(run)                 # Id of the server run, shared by all its workers
+        self.directory = directory
+        self.keep = keep                    # Dataset versions kept on disk
+        self.progress_age = progress_age    # Seconds after which progress files are removed
+        self._threads = {}                  # upload key -> ingesting thread of this worker
+        self._lock = threading.Lock()
+        private_dir(directory)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    # Writes the file atomically, other workers never read a half written one.
+    def _write(self, name, text):
+        tmp_path = self._path(name) + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, self._path(name))
+
+    # Returns the current dataset version, None while nothing has been uploaded in this server run.
+    def current(self):
+        try:
+            with open(self._path('dataset.current')) as f:
+                version, run = f.read().split()
+        except (OSError, ValueError):
+            return None
+        return version if run == self.run and token_pattern.match(version) else None
+
+    def load(self, version):
+        return load_dataset(self._path('dataset-' + version + '.feather'))
+
+    # Starts ingesting the upload in the background, unless it is already being ingested by this worker.
+    def start(self, key, contents):
+        with self._lock:
+            if key in self._threads:
+                return
+            thread = threading.Thread(target=self._ingest, args=(key, contents), daemon=True)
+            self._threads[key] = thread
+        self._write_progress(key, fraction=0.0, rows=0)
+        thread.start()
+
+    def _ingest(self, key, contents):
+        try:
+            df = ingest_upload(contents, progress=lambda fraction, rows: self._write_progress(key, fraction=fraction, rows=rows))
+            version = uuid.uuid4().hex[:16]
+            tmp_path = self._path('dataset-' + version + '.feather.' + str(os.getpid()) + '.tmp')
+            save_dataset(df, tmp_path)
+            os.replace(tmp_path, self._path('dataset-' + version + '.feather'))
+            self._write('dataset.current', version + ' ' + self.run)
+            self._write_progress(key, fraction=1.0, rows=len(df), done=True, version=version)
+            self._prune()
+        except Exception as error:
+            self._write_progress(key, done=True, error='{}: {}'.format(type(error).__name__, error))
+        finally:
+            with self._lock:
+                del self._threads[key]
+
+    def _write_progress(self, key, **progress):
+        self._write('upload-' + key + '.progress', json.dumps(progress))
+
+    # Returns the progress of the upload (fraction, rows, done, and version or error when done), None if unknown.
+    # key comes from the browser, anything but a key made by upload_key is rejected.
+    def progress(self, key):
+        if not isinstance(key, str) or not token_pattern.match(key):
+            return None
+        try:
+            with open(self._path('upload-' + key + '.progress')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # Removes all but the keep newest dataset versions and the old progress files.
+    def _prune(self):
+        versions = []
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.startswith('dataset-') and entry.name.endswith('.feather'):
+                    versions.append((entry.stat().st_mtime, entry.path))
+                elif entry.name.endswith('.progress') and now - entry.stat().st_mtime > self.progress_age:
+                    os.remove(entry.path)
+            except OSError:
+                continue
+        versions.sort()
+        for _, path in versions[:-self.keep]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+# Returns the key of an upload, the name of its progress file.
+# The contents are hashed a block at a time, never copied as a whole.
+def upload_key(contents, block_size=4 * 2**20):
+    digest = hashlib.sha1()
+    for start in range(0, len(contents), block_size):
+        digest.update(contents[start:start + block_size].encode())
+    return digest.hexdigest()[:16]
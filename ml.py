@@ -8,24 +8,33 @@ import matplotlib.font_manager
 from sklearn.covariance import EllipticEnvelope
 from sklearn.ensemble import IsolationForest
 from sklearn.neighbors import LocalOutlierFactor
+from models import n_jobs
 
-df = pd.read_csv('./data/final_data.csv')
+from dataset import load_dataset
+from preprocess import time_columns
+from tower_index import TowerIndex
+from features import feature_matrix, feature_columns
+
+df = load_dataset()
 towers=pd.read_csv('./data/towers_min.csv')
-def anomalies(df,algo="IsolationForest",contamination=0.001):
-    cdr_df=pd.merge(df,towers[['lat','lon','TowerID']],on='TowerID')
-    cdr_df=cdr_df[["Caller","Receiver","Time","Duration","lat","lon"]]
-    # cdr_df['Date']=pd.to_datetime(cdr_df['Date'],format='%d-%m-%Y')
-    cdr_df['Time']=pd.to_datetime(cdr_df['Time'],format='%H:%M:%S')
-    cdr_df["Time"]=cdr_df["Time"].apply(lambda x: (x - x.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds())
+tower_index=TowerIndex(towers)
+def anomalies(df,algo="IsolationForest",contamination=0.001,n_jobs=n_jobs):
+    # Same feature matrix as the ML modes of the dashboard, time of day, duration, lat and lon columns
+    if 'Time_sec' not in df:
+        time_columns(df)
+    X=feature_matrix(df,tower_index)[:, [feature_columns.index(c) for c in ["Time_sec","Duration","lat","lon"]]]
+    known=np.isfinite(X).all(axis=1) # Records of towers without a location are left out
+    cdr_df=df[known][["Caller","Receiver","Timestamp","Duration"]]
     if (algo=="IsolationForest"):
-        iso=IsolationForest(contamination=contamination)
+        iso=IsolationForest(contamination=contamination,n_jobs=n_jobs)
     elif(algo=="EllipticEnvelope"):
         iso=EllipticEnvelope(contamination=contamination)
     elif(algo=="LocalOutlierFactor"):
-        iso=LocalOutlierFactor(contamination=contamination)
-    mask=iso.fit_predict(cdr_df[["Time","Duration","lat","lon"]])==-1
+        iso=LocalOutlierFactor(contamination=contamination,n_jobs=n_jobs)
+    mask=iso.fit_predict(X[known])==-1
     cdr_df=cdr_df[mask]
     # print(cdr_df)
+    return cdr_df
 
 
 anomalies(df)
\ No newline at end of file
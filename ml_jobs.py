@@ -0,0 +1,104 @@
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from models import ModelRegistry, n_jobs
+
+# Out of process fitting of the anomaly detectors (models.py).
+# Fits run in a process pool sized by the CPU count, so a long fit never blocks the
+# Dash request thread and the other callbacks stay responsive. The feature matrix of
+# the dataset is copied once into a shared memory block that the pool processes map
+# read only, instead of being pickled into every task. A fitted detector is persisted
+# by the registry, so the web worker picks its scores up from disk once the task is done.
+# A fit that fails is remembered and reported as a FitError, it is not submitted again.
+
+
+# Runs in a pool process: fits the detector on the shared matrix, the registry writes model and scores to disk.
+def _fit(directory, key, kind, features, block_name, shape, dtype):
+    block = shared_memory.SharedMemory(name=block_name)
+    try:
+        X = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        ModelRegistry(directory).get(key, kind, features, X)
+        del X
+    finally:
+        block.close()
+
+
+# Raised by ScoringPool.scores for a detector whose fit failed.
+class FitError(RuntimeError):
+    pass
+
+
+class ScoringPool:
+
+    def __init__(self, registry, workers=None):
+        self.registry = registry
+        self.workers = workers or max(1, (os.cpu_count() or 1) // max(n_jobs, 1))
+        self._executor = None
+        self._blocks = {}   # dataset key -> shared memory block holding its feature matrix
+        self._jobs = {}     # (key, kind, features) -> Future of the fit
+        self._failed = {}   # (key, kind, features) -> message of the failed fit
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    # Copies X into shared memory once per dataset.
+    def _share(self, key, X):
+        if key not in self._blocks:
+            block = shared_memory.SharedMemory(create=True, size=max(X.nbytes, 1))
+            np.ndarray(X.shape, dtype=X.dtype, buffer=block.buf)[:] = X
+            self._blocks[key] = block
+        self._free_blocks(keep=key)
+        return self._blocks[key]
+
+    # Frees the blocks of previous datasets once none of their fits is queued or running,
+    # a queued fit attaches to its block only when it starts.
+    def _free_blocks(self, keep):
+        busy = {name[0] for name, job in self._jobs.items() if not job.done()}
+        for key in list(self._blocks):
+            if key != keep and key not in busy:
+                block = self._blocks.pop(key)
+                block.close()
+                block.unlink()
+
+    # Returns the scores of the rows (positions into X), or None while the detector is still being fitted.
+    # The first call for a detector that is not fitted yet starts its fit in the pool.
+    # Raises FitError if the fit failed.
+    def scores(self, key, kind, features, X, rows):
+        name = (key, kind, features)
+        with self._lock:
+            if name in self._failed:
+                raise FitError(self._failed[name])
+            job = self._jobs.get(name)
+            if job is None and not self.registry.fitted(key, kind, features):
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                block = self._share(key, X)
+                self._jobs[name] = self._executor.submit(_fit, self.registry.directory, key, kind, features,
+                                                         block.name, X.shape, X.dtype.str)
+                return None
+            if job is not None:
+                if not job.done():
+                    return None
+                del self._jobs[name]
+                self._free_blocks(keep=key)
+                try:
+                    job.result()
+                except Exception as error:
+                    self._failed[name] = kind + ' could not be fitted: ' + str(error)
+                    raise FitError(self._failed[name]) from error
+        return self.registry.scores(key, kind, features, X, rows)
+
+    # Stops the pool and frees the shared memory.
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            for block in self._blocks.values():
+                block.close()
+                block.unlink()
+            self._blocks.clear()
@@ -34,6 +34,7 @@ ml_layout=html.Div([
             
 
         ),
+        dcc.Interval(id='ml-interval', interval=1000, disabled=True),   # Polls the detector fits running in the background
     ]),
 
 
@@ -0,0 +1,89 @@
+import os
+import threading
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+from sklearn.covariance import EllipticEnvelope
+from sklearn.ensemble import IsolationForest
+from sklearn.neighbors import LocalOutlierFactor
+
+from session_store import default_store_dir, private_dir
+
+# Fitted anomaly detectors for the ML filter modes.
+# Every detector is fitted once per (feature matrix, feature set) on the whole dataset and
+# written with joblib next to the session store, so every worker reuses it. The scores
+# of all rows are kept with the model; a filter change only gathers the scores of the
+# filtered rows and the contamination slider becomes a quantile of those scores, so
+# moving it never refits anything. Model files of old datasets are evicted from disk with
+# the stored frames (see SessionStore._evict_disk).
+# Scores are score_samples of the detector (negative_outlier_factor_ for LOF): the lower, the more abnormal.
+
+scores_version = 2   # Part of the file names, models saved with scores computed differently are not reused
+n_jobs = int(os.environ.get('CDR_ML_JOBS', '1'))   # Cores used by one IsolationForest or LocalOutlierFactor fit
+
+detector_kinds = {
+    'IsolationForest': lambda: IsolationForest(random_state=0, n_jobs=n_jobs),
+    'EllipticEnvelope': lambda: EllipticEnvelope(random_state=0),
+    'LocalOutlierFactor': lambda: LocalOutlierFactor(novelty=True, n_jobs=n_jobs),   # novelty so that new records can be scored
+}
+
+
+class ModelRegistry:
+
+    def __init__(self, directory=default_store_dir, max_models=6):
+        self.directory = directory
+        self.max_models = max_models
+        self._models = OrderedDict()    # (key, kind, features) -> (model, scores)
+        self._lock = threading.Lock()
+        private_dir(directory)
+
+    def _path(self, key, kind, features):
+        return os.path.join(self.directory, '-'.join([key, kind, features, 'v' + str(scores_version)]) + '.joblib')
+
+    # True if the detector for the dataset has been fitted, by this worker or any other process.
+    def fitted(self, key, kind, features):
+        with self._lock:
+            if (key, kind, features) in self._models:
+                return True
+        return os.path.exists(self._path(key, kind, features))
+
+    # Returns the (model, scores) of the detector for the dataset, fitting it on X the first time.
+    # key is the hash of X (features.feature_hash) and features names its columns.
+    def get(self, key, kind, features, X):
+        name = (key, kind, features)
+        with self._lock:
+            if name in self._models:
+                self._models.move_to_end(name)
+                return self._models[name]
+            path = self._path(key, kind, features)
+            try:
+                entry = joblib.load(path)
+                os.utime(path)      # Mark as recently used for the disk LRU of the session store
+            except (OSError, EOFError, ValueError):
+                # Rows with missing features (e.g. unknown towers) are left out and get a NaN score.
+                finite = np.isfinite(X).all(axis=1)
+                fit_X = X if finite.all() else X[finite]
+                model = detector_kinds[kind]().fit(fit_X)
+                scores = np.full(len(X), np.nan)
+                # score_samples is for new data; the rows LOF was fitted on have their own negative outlier factors
+                scores[finite] = model.negative_outlier_factor_ if kind == 'LocalOutlierFactor' else model.score_samples(fit_X)
+                entry = (model, scores)
+                tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+                joblib.dump(entry, tmp_path)
+                os.replace(tmp_path, path)
+            self._models[name] = entry
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+            return entry
+
+    # Returns the scores of the rows (positions into X) of the dataset.
+    def scores(self, key, kind, features, X, rows):
+        return self.get(key, kind, features, X)[1][rows]
+
+
+# Returns the mask of the contamination fraction of rows with the lowest scores (NaN scores are never outliers).
+def outliers(scores, contamination):
+    if not np.isfinite(scores).any():
+        return np.zeros(len(scores), dtype=bool)
+    return scores <= np.nanquantile(scores, contamination)
@@ -0,0 +1,76 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+# Vectorised stages used by preprocess_data in dash_script.py.
+# Every stage works on whole columns, no per row python calls.
+
+ipdr_receiver = 20000   # Receiver value of the IPDR rows (see data/final_data_generator.py)
+
+
+# Returns the sorted array of phone numbers that appear as Caller or Receiver.
+def node_numbers(df):
+    receivers = df['Receiver'].unique()
+    receivers = receivers[receivers != ipdr_receiver]
+    return np.union1d(df['Caller'].unique(), receivers)
+
+
+# Returns the position of every number in the sorted nodes array, -1 if it is not a node.
+def encode_numbers(numbers, nodes):
+    numbers = np.asarray(numbers)
+    if len(nodes) == 0:
+        return np.full(len(numbers), -1, dtype=np.int64)
+    codes = np.searchsorted(nodes, numbers)
+    codes = np.minimum(codes, len(nodes) - 1)
+    return np.where(nodes[codes] == numbers, codes, -1).astype(np.int64)
+
+
+# Adds Caller_node, Receiver_node and IMEI_node columns and returns the nodes array.
+def encode_nodes(df):
+    nodes = node_numbers(df)
+    df['Caller_node'] = encode_numbers(df['Caller'].values, nodes)
+    df['Receiver_node'] = encode_numbers(df['Receiver'].values, nodes)
+    df.loc[df['Receiver'] == ipdr_receiver, 'Receiver_node'] = -1
+    df['IMEI_node'] = np.where(df['Caller'].values != ipdr_receiver, df['Caller_node'].values, -1)
+    return nodes
+
+
+# Returns the app name for every destination port, None for ports without an app.
+def app_names(ports, ports_to_apps):
+    names = pd.Series(ports).astype(str).map(ports_to_apps)
+    return names.where(names.notna() & (names != 'nan'), None)
+
+
+# Adds Epoch (seconds since 1970, int64) and Time_sec (seconds since midnight, int32) from Timestamp.
+def time_columns(df):
+    epoch = df['Timestamp'].values.astype('datetime64[s]').astype(np.int64)
+    df['Epoch'] = epoch
+    df['Time_sec'] = (epoch % 86400).astype(np.int32)
+
+
+# Returns the [start, end) epoch bounds covering the whole days from date1 to date2 (date picker values).
+def date_bounds(date1, date2):
+    start = pd.Timestamp(date1).normalize().value // 10**9
+    end = pd.Timestamp(date2).normalize().value // 10**9 + 86400
+    return start, end
+
+
+# Returns df sorted by Epoch, the order date_slice relies on.
+def sort_by_time(df):
+    return df.sort_values('Epoch', kind='mergesort').reset_index(drop=True)
+
+
+# Returns the rows of a time sorted df between the dates, found by binary search on Epoch.
+def date_slice(df, date1, date2):
+    start, end = date_bounds(date1, date2)
+    epoch = df['Epoch'].values
+    return df.iloc[np.searchsorted(epoch, start, 'left'):np.searchsorted(epoch, end, 'left')]
+
+
+# Returns a short hash of the call graph of df, used as the key of caches that depend on the dataset.
+def dataset_hash(df):
+    digest = hashlib.sha1()
+    for column in ('Caller', 'Receiver', 'Epoch'):
+        digest.update(np.ascontiguousarray(df[column].values).tobytes())
+    return digest.hexdigest()[:16]
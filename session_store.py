@@ -0,0 +1,167 @@
+import os
+import re
+import sys
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import pyarrow as pa
+from pyarrow import feather
+from scipy import sparse
+
+# Server side store for the filtered dataframe.
+# Instead of serialising the whole frame to JSON for the hidden 'filtered-data' div,
+# the frame is written once to a directory shared by all gunicorn workers and only
+# a short token travels through the browser. Every worker additionally keeps the most
+# recently used frames in memory (LRU, bounded by memory_limit bytes), and the tables derived
+# from them (LRU, bounded by derived_limit bytes).
+# Files on disk are Feather (Arrow) files of the frame and its index. Numeric and categorical
+# columns are read back as whole buffers; the string and date columns (Time, Date, IPs) are
+# rebuilt from their Arrow buffers by pyarrow in one pass, nothing is unpickled per element.
+
+default_store_dir = os.environ.get('CDR_STORE_DIR', os.path.join(tempfile.gettempdir(), 'cdr-viz-store'))
+evicted_suffixes = ('.arrow', '.joblib', '.layout')   # Frames, fitted models (models.py) and layouts (graph_layout.py)
+token_pattern = re.compile(r'^[0-9a-f]{16}$')   # Tokens made by put, anything else from the browser is rejected
+
+
+# Creates the store directory (readable by this user only) and checks that it belongs to this user.
+# The frames, layouts and models loaded from it must not come from anyone else.
+def private_dir(directory):
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+    if hasattr(os, 'getuid') and info.st_uid != os.getuid():
+        raise PermissionError('Store directory ' + directory + ' belongs to another user')
+    if info.st_mode & 0o077:
+        os.chmod(directory, 0o700)
+    return directory
+
+
+# Returns the approximate number of bytes held by a derived value: the arrays, sparse matrices and
+# frames in it, directly or in its lists, tuples, dicts and attributes.
+def value_size(value, depth=4):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if sparse.issparse(value):
+        return sum(getattr(value, name).nbytes for name in ('data', 'indices', 'indptr', 'row', 'col', 'offsets') if hasattr(value, name))
+    if hasattr(value, 'memory_usage'):     # DataFrame or Series
+        usage = value.memory_usage(index=True, deep=True)
+        return int(usage.sum() if hasattr(usage, 'sum') else usage)
+    if depth == 0:
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(value_size(k, depth - 1) + value_size(v, depth - 1) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(value_size(item, depth - 1) for item in value)
+    if hasattr(value, '__dict__'):
+        return value_size(vars(value), depth - 1)
+    return sys.getsizeof(value)
+
+
+class SessionStore:
+
+    def __init__(self, directory=default_store_dir, memory_limit=256 * 2**20, disk_limit=2 * 2**30, derived_limit=256 * 2**20):
+        self.directory = directory
+        self.memory_limit = memory_limit    # bytes of frames kept in memory by this worker
+        self.disk_limit = disk_limit        # bytes of frames, models and layouts kept on disk by all workers together
+        self.derived_limit = derived_limit  # bytes of derived tables kept in memory by this worker
+        self._frames = OrderedDict()        # (token, tag) -> (frame, size)
+        self._derived = OrderedDict()       # (token, tag, name) -> (value computed from the frame, size)
+        self._memory_used = 0
+        self._derived_used = 0
+        self._lock = threading.Lock()
+        private_dir(directory)
+
+    def _path(self, token, tag):
+        return os.path.join(self.directory, token + '-' + tag + '.arrow')
+
+    # Stores the frame and returns the token to be put in the div.
+    # tag names the dataset the frame was filtered from, get only returns it for the same tag.
+    def put(self, df, tag):
+        token = uuid.uuid4().hex[:16]
+        path = self._path(token, tag)
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        feather.write_feather(pa.Table.from_pandas(df), tmp_path, compression='lz4')
+        os.replace(tmp_path, path)          # Other workers never see a half written file.
+        self._remember(token, tag, df)
+        self._evict_disk(keep=path)
+        return token
+
+    # Returns the frame for the token or None if it has been evicted or was stored under another tag.
+    # The returned frame is shared between callbacks and must not be modified in place.
+    def get(self, token, tag):
+        if not token or not isinstance(token, str) or not token_pattern.match(token):
+            return None
+        with self._lock:
+            if (token, tag) in self._frames:
+                self._frames.move_to_end((token, tag))
+                return self._frames[(token, tag)][0]
+        path = self._path(token, tag)
+        try:
+            df = feather.read_table(path).to_pandas()
+            os.utime(path)                  # Mark as recently used for the disk LRU.
+        except (OSError, pa.ArrowException):
+            return None
+        self._remember(token, tag, df)
+        return df
+
+    # Returns build(frame) for the token, computed once per worker and kept while it is recently used.
+    # Used for tables derived from a filtered frame (statistics, graphs) that several callbacks need.
+    def derived(self, token, tag, name, build):
+        with self._lock:
+            if (token, tag, name) in self._derived:
+                self._derived.move_to_end((token, tag, name))
+                return self._derived[(token, tag, name)][0]
+        df = self.get(token, tag)
+        if df is None:
+            return None
+        value = build(df)
+        size = value_size(value)
+        if size > self.derived_limit:
+            return value
+        with self._lock:
+            if (token, tag, name) in self._derived:
+                return value
+            self._derived[(token, tag, name)] = (value, size)
+            self._derived_used += size
+            while self._derived_used > self.derived_limit:
+                _, (_, old_size) = self._derived.popitem(last=False)
+                self._derived_used -= old_size
+        return value
+
+    def _remember(self, token, tag, df):
+        size = int(df.memory_usage(index=True, deep=True).sum())   # deep counts the object columns (e.g. Date, Time)
+        if size > self.memory_limit:
+            return
+        with self._lock:
+            if (token, tag) in self._frames:
+                return
+            self._frames[(token, tag)] = (df, size)
+            self._memory_used += size
+            while self._memory_used > self.memory_limit:
+                _, (_, old_size) = self._frames.popitem(last=False)
+                self._memory_used -= old_size
+
+    def _evict_disk(self, keep):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(evicted_suffixes):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            total += stat.st_size
+            if entry.path != keep:          # The frame just written is never evicted.
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.disk_limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -1,92 +1,153 @@
 import pandas as pd
-def meanDur(nodeNumber,df):
-    #print(df['Caller_node'].unique(),df['Receiver_node'].unique(),nodeNumber)
-    return df[(df['Receiver_node']!=-1)&((df['Caller_node'] == nodeNumber) | (df['Receiver_node'] == nodeNumber)) ]['Duration'].mean()
+import numpy as np
+from scipy import sparse
+
+from callgraph import CallGraph
+
+#Per node aggregates of the calls (CDR rows) of a dataframe,
+#computed in one pass with np.bincount over the encoded
+#Caller_node/Receiver_node columns. Arrays are indexed by node number.
+#total_duration -> sum of the durations of the calls of the node
+#calls -> no. of calls made or received (a call to itself counts once)
+#out_calls/in_calls -> no. of outgoing/incomming calls
+#out_degree/in_degree -> no. of distinct numbers called/calling, read from the CallGraph of df
+#graph -> CallGraph of df if already built (e.g. the one cached per filtered frame)
+class NodeStats:
+    def __init__(self, df, graph=None, num_nodes=None):
+        cdr = df[df['Receiver_node']!=-1]
+        caller = cdr['Caller_node'].values
+        receiver = cdr['Receiver_node'].values
+        duration = cdr['Duration'].values.astype(float)
+        if graph is None:
+            graph = CallGraph(df, num_nodes)
+        n = len(graph)
+        loop = caller == receiver
+        self.out_calls = np.bincount(caller, minlength=n)
+        self.in_calls = np.bincount(receiver, minlength=n)
+        self.calls = self.out_calls + self.in_calls - np.bincount(caller[loop], minlength=n)
+        self.total_duration = np.bincount(caller, weights=duration, minlength=n) + \
+            np.bincount(receiver[~loop], weights=duration[~loop], minlength=n)
+        self.out_degree = graph.out_degree()
+        self.in_degree = graph.in_degree()
+        self.max_duration = duration.max() if len(duration) else 0
+
+    def mean_duration(self, node):
+        if node >= len(self.calls) or self.calls[node] == 0:
+            return np.nan
+        return self.total_duration[node]/self.calls[node]
+
+    #All the aggregates as a dataframe indexed by node number
+    def table(self):
+        return pd.DataFrame({'total_duration': self.total_duration, 'calls': self.calls,
+                             'out_calls': self.out_calls, 'in_calls': self.in_calls,
+                             'out_degree': self.out_degree, 'in_degree': self.in_degree})
+
+#returns the mean duration of the calls of the node
+def meanDur(nodeNumber,node_stats):
+    return node_stats.mean_duration(nodeNumber)
+
+#returns a (nodes x bins) array with the minutes of talk time
+#of every node in every bin, for all the nodes at once.
+#bin_minutes -> width of a bin in minutes, must divide the period (1440 or 10080 minutes)
+#period -> 'day' for bins over the time of day (24 bins of 60 minutes by default)
+#          'week' for bins over the week, starting Monday 00:00 (e.g. bin_minutes=1440 for days)
+#Every call is split at the bin boundaries it crosses and each piece
+#is added to the bin of its caller and receiver with np.bincount.
+#Calls running past the end of the period continue in its first bins.
+def talkTime(df,bin_minutes=60,period='day',num_nodes=None):
+    cdr = df[df['Receiver_node']!=-1]
+    caller = cdr['Caller_node'].values
+    receiver = cdr['Receiver_node'].values
+    if num_nodes is None:
+        num_nodes = int(max(caller.max(), receiver.max())) + 1 if len(cdr) else 0
+    if period == 'day':
+        start = cdr['Time_sec'].values//60
+        period_minutes = 1440
+    else:
+        start = (cdr['Epoch'].values//60 + 3*1440) % 10080  # 01-01-1970 was a Thursday
+        period_minutes = 10080
+    if period_minutes % bin_minutes != 0:
+        raise ValueError('bin_minutes must divide the ' + str(period_minutes) + ' minutes of a ' + period)
+    bins = period_minutes//bin_minutes
+    dur = cdr['Duration'].values
+    end = start + dur
+    first = start//bin_minutes
+    last = np.where(dur>0, (end-1)//bin_minutes, first)
+    # One piece per call and bin, row is the call of each piece
+    pieces = last - first + 1
+    row = np.repeat(np.arange(len(cdr)), pieces)
+    bin_abs = first[row] + np.arange(len(row)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    minutes = np.minimum(end[row], (bin_abs+1)*bin_minutes) - np.maximum(start[row], bin_abs*bin_minutes)
+    bin_no = bin_abs % bins
+    other = caller[row] != receiver[row]  # A call to itself is counted once
+    m = np.bincount(caller[row]*bins + bin_no, weights=minutes, minlength=num_nodes*bins) + \
+        np.bincount(receiver[row][other]*bins + bin_no[other], weights=minutes[other], minlength=num_nodes*bins)
+    return m.reshape(num_nodes, bins)
 
 #returns a dictionary with the number of minutes of talk
-#time corresponding to each hour of the day
+#time of the 3 busiest hours of the day of the node
 #Note that m[i] corresponds to the total minutes of talk
 #time from ith hour to (i+1)th hour
-def peakHours(nodeNumber,df):
-    m = {}
-    for i in range(24):
-        m[i] = 0
-    df1 = df[(df['Receiver_node']!=-1)&((df['Caller_node'] == nodeNumber) | (df['Receiver_node'] == nodeNumber)) ]
-    for i in list(df1.index):
-        h = int(df1.at[i,'Time'][0:2])
-        min = int(df1.at[i,'Time'][3:5])
-        dur = df1.at[i,'Duration']
-        min = 60-min
-        if(dur>min):
-             m[h]+=min
-        else:
-             m[h]+=dur
-        dur -= min
-        while(dur>0):
-            h = (h + 1)%24
-            if(dur>60):
-                m[h]+=60
-                dur-=60
-            else:
-                m[h]+=dur
-                dur = 0
-    m={k: v for k, v in sorted(m.items(), key=lambda item: item[1], reverse=True)}
-    i = 0
+#hours is the talkTime table of the dataframe
+def peakHours(nodeNumber,hours):
+    if nodeNumber >= len(hours):
+        return {}
+    m = hours[nodeNumber]
     n = {}
-    for x in m:
-        if i<3:
-            n[x]=m[x]
-            i+=1
-        else:
-            break
+    for x in np.argsort(-m, kind='stable')[:3]:
+        n[int(x)] = int(m[x]) if float(m[x]).is_integer() else m[x]
     return n
 
 #returns a list of size 2
 #first element -> no. of outgoing calls
 #second element -> no. of incomming calls
-def ogIc(x,df):
-    z = [0,0]
-    z[0] = len(df[df['Caller_node'] == x])
-    z[1] = len(df[df['Receiver_node'] == x])
-    return z
+def ogIc(x,node_stats):
+    if x >= len(node_stats.calls):
+        return [0,0]
+    return [int(node_stats.out_calls[x]), int(node_stats.in_calls[x])]
+
+#Calls between every pair of numbers, from the CallGraph of a dataframe.
+#Answers the most called numbers of every node and its top contacts
+#from the sparse call count and duration matrices, without rescanning rows.
+#most_to/most_from/most_total -> node most called to/from/in total by each node, -1 if none
+class Contacts:
+    def __init__(self, graph):
+        self.graph = graph
+        counts = graph.counts
+        loops = sparse.diags(counts.diagonal())  # A call to itself is counted once
+        self.total_counts = (counts + counts.T - loops).tocsr()
+        self.total_durations = (graph.durations + graph.durations.T - sparse.diags(graph.durations.diagonal())).tocsr()
+        self.most_to = self._argmax(counts)
+        self.most_from = self._argmax(counts.T.tocsr())
+        self.most_total = self._argmax(self.total_counts)
+
+    @staticmethod
+    def _argmax(matrix):
+        if matrix.shape[0] == 0:
+            return np.zeros(0, dtype=int)
+        best = np.asarray(matrix.argmax(axis=1)).ravel()
+        return np.where(np.diff(matrix.indptr) > 0, best, -1)
+
+    #returns up to k (number, calls, total duration) tuples of the
+    #numbers the node talked to most, in either direction
+    def top(self, node, k=5):
+        row = slice(self.total_counts.indptr[node], self.total_counts.indptr[node+1])
+        others = self.total_counts.indices[row]
+        calls = self.total_counts.data[row]
+        durations = self.total_durations.getrow(node).toarray().ravel()[others]
+        order = np.argsort(-calls, kind='stable')[:k]
+        return [(int(self.graph.numbers[others[i]]), int(calls[i]), durations[i]) for i in order]
 
 #returns a list of size 3
 #first element -> most calls to
 #second element -> most calls from
 #third element -> most calls in total
-def mostCalls(nodeNumber,df):
-    m1 = {}
-    m2 = {}
-    m3 = {}
-    df1 = df[(df['Receiver_node']!=-1)&((df['Caller_node'] == nodeNumber) | (df['Receiver_node'] == nodeNumber)) ]
-    for i in list(df1.index):
-        if df1.at[i,'Caller_node'] == nodeNumber:
-            if df1.at[i,'Receiver'] in m1:
-                m1[df1.at[i,'Receiver']]+=1
-                m3[df1.at[i,'Receiver']]+=1
-            else:
-                m1[df1.at[i,'Receiver']]=1
-                m3[df1.at[i,'Receiver']]=1
-        elif df1.at[i,'Receiver_node'] == nodeNumber:
-            if df1.at[i,'Caller'] in m2:
-                m2[df1.at[i,'Caller']]+=1
-                m3[df1.at[i,'Caller']]+=1
-            else:
-                m2[df1.at[i,'Caller']]=1
-                m3[df1.at[i,'Caller']]=1
+#contacts is the Contacts table of the dataframe
+def mostCalls(nodeNumber,contacts):
     z = []
-    if not not m1:
-        z.append(max(m1, key=m1.get))
-    else:
-        z.append("None")
-    if not not m2:
-        z.append(max(m2, key=m2.get))
-    else:
-        z.append("None")
-    if not not m3:
-        z.append(max(m3, key=m3.get))
-    else:
-        z.append("None")
-
+    for most in (contacts.most_to, contacts.most_from, contacts.most_total):
+        if nodeNumber < len(most) and most[nodeNumber] != -1:
+            z.append(contacts.graph.numbers[most[nodeNumber]])
+        else:
+            z.append("None")
     return z
-
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+# Spatial index over the cell towers (towers_min.csv), built once at startup.
+# A BallTree with the haversine metric on (lat, lon) in radians answers the radius
+# filter and the nearest tower lookups without touching every tower.
+# Every TowerID is also given a dense integer code, and the tower attributes are kept
+# in NumPy arrays aligned to those codes, so per tower values are a plain gather.
+
+earth_radius = 6373.0   # km
+
+
+class TowerIndex:
+
+    def __init__(self, towers):
+        self.towers = towers.drop_duplicates('TowerID').reset_index(drop=True)
+        self.tower_ids = self.towers['TowerID'].values       # code -> TowerID
+        self.index = pd.Index(self.tower_ids)                 # TowerID -> code
+        self.lat = self.towers['lat'].values
+        self.lon = self.towers['lon'].values
+        self.suspicious = self.towers['Suspicious'].values if 'Suspicious' in self.towers else np.zeros(len(self.towers), dtype=int)
+        self.tree = BallTree(np.radians(self.towers[['lat', 'lon']].values), metric='haversine')
+
+    # Returns the code of every TowerID, -1 for towers that are not in the index.
+    def encode(self, tower_ids):
+        if hasattr(tower_ids, 'cat'):
+            # Categorical column: look up each category once and gather by the category codes.
+            category_codes = self.index.get_indexer(tower_ids.cat.categories)
+            codes = tower_ids.cat.codes.values
+            return np.where(codes >= 0, category_codes[codes], -1)
+        return self.index.get_indexer(tower_ids)
+
+    # Sums of Duration and number of rows per tower code.
+    def duration_sums(self, codes, durations):
+        known = codes >= 0
+        sums = np.bincount(codes[known], weights=durations[known], minlength=len(self.tower_ids))
+        counts = np.bincount(codes[known], minlength=len(self.tower_ids))
+        return sums, counts
+
+    # Returns the mean and standard deviation (ddof=1) of the call duration of every tower from df.
+    def duration_stats(self, df):
+        durations = df['Duration'].values.astype(float)
+        sums, counts = self.duration_sums(df['Tower_code'].values, durations)
+        squares, _ = self.duration_sums(df['Tower_code'].values, durations**2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(counts > 0, sums / counts, np.nan)
+            variance = (squares - sums * mean) / (counts - 1)
+            std = np.where(counts > 1, np.sqrt(np.maximum(variance, 0)), np.nan)
+        return mean, std
+
+    # Returns the TowerIDs within radius km of the point.
+    def within(self, lat, lon, radius):
+        positions = self.tree.query_radius(np.radians([[lat, lon]]), r=radius / earth_radius)[0]
+        return self.tower_ids[positions]
+
+    # Returns the TowerID of the tower closest to the point.
+    def nearest(self, lat, lon):
+        _, positions = self.tree.query(np.radians([[lat, lon]]), k=1)
+        return self.tower_ids[positions[0][0]]